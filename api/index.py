@@ -4,8 +4,9 @@ Vercel serverless function entry point - Web API compatible
 import sys
 import os
 import json
-from http.server import BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
 
 # Add the parent directory to Python path so we can import from src
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,66 +14,101 @@ parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
 
 
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def _get_pipeline():
+    """Return the shared request pipeline, building it on first use."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                try:
+                    from src.config import Config
+                    from src.location_risk_service import LocationRiskService
+                    from src.sea_level_service import SeaLevelService
+                    from src.pipeline import RequestPipeline
+
+                    config = Config()
+                    _pipeline = RequestPipeline(
+                        config,
+                        LocationRiskService(config),
+                        SeaLevelService(config)
+                    )
+                except Exception as e:
+                    print(
+                        f"Warning: Could not load config for security validation: {e}")
+    return _pipeline
+
+
 class handler(BaseHTTPRequestHandler):
     """Vercel-compatible HTTP handler class"""
 
-    def __init__(self, *args, **kwargs):
-        """Initialize handler with config"""
-        # Initialize config for security validation
-        try:
-            from src.config import Config
-            self.config = Config()
-        except Exception as e:
-            self.config = None
-            print(
-                f"Warning: Could not load config for security validation: {e}")
-
-        super().__init__(*args, **kwargs)
-
-    def _validate_api_security(self):
-        """Validate API key and vendor ID from headers"""
-        # Get headers (case-insensitive)
-        api_key = self.headers.get(
-            'X-API-Key') or self.headers.get('x-api-key')
-        vendor_id = self.headers.get(
-            'X-Vendor-ID') or self.headers.get('x-vendor-id')
-
-        # Check if security headers are present
-        if not api_key:
-            return False, {"error": "Missing X-API-Key header", "code": "MISSING_API_KEY"}
-
-        if not vendor_id:
-            return False, {"error": "Missing X-Vendor-ID header", "code": "MISSING_VENDOR_ID"}
-
-        # Check if config is available
-        if not self.config:
-            return False, {"error": "Server configuration error", "code": "CONFIG_ERROR"}
-
-        # Validate credentials using config
-        if not self.config.validate_credentials(api_key, vendor_id):
-            # Determine which credential is invalid for better error messaging
-            if api_key != self.config.get_api_key():
-                return False, {"error": "Invalid API key", "code": "INVALID_API_KEY"}
-            else:
-                return False, {"error": "Invalid vendor ID", "code": "INVALID_VENDOR_ID"}
-
-        # Both credentials are valid
-        return True, {"vendor_id": vendor_id, "api_key": api_key}
+    # Keep connections open between requests; every response must therefore
+    # carry a Content-Length and every request body must be fully consumed.
+    protocol_version = "HTTP/1.1"
+    # Seconds an idle persistent connection is kept before it is closed; each
+    # one holds a server thread
+    timeout = 10
 
     def _is_public_endpoint(self, path):
         """Check if the endpoint is public (no auth required)"""
-        public_endpoints = ['/', '/health', '/docs']
-        return path in public_endpoints
+        from src.pipeline import PUBLIC_ENDPOINTS
+        return path in PUBLIC_ENDPOINTS
+
+    def _read_body(self):
+        """
+        Read the full request body so the connection can be reused.
+
+        Bodies whose length cannot be determined are rejected and the
+        connection is closed, since their bytes would otherwise be parsed as
+        the next request.
+
+        Returns:
+            The body, or None if an error response has already been sent
+        """
+        if self.headers.get('Transfer-Encoding'):
+            self.close_connection = True
+            self._send_response(
+                411, {"error": "Chunked request bodies are not supported; send Content-Length"})
+            return None
+
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self.close_connection = True
+            self._send_response(400, {"error": "Invalid Content-Length header"})
+            return None
+
+        if content_length > 0:
+            return self.rfile.read(content_length)
+        return b''
+
+    def _config_error(self):
+        """Send the error used when the pipeline could not be configured"""
+        self._send_response(
+            401, {"error": "Server configuration error", "code": "CONFIG_ERROR"})
 
     def do_GET(self):
         """Handle GET requests"""
+        # A GET body is ignored, but must still be consumed so its bytes are
+        # not parsed as the next request on this connection
+        if self._read_body() is None:
+            return
         try:
             parsed_path = urlparse(self.path)
             path = parsed_path.path
 
             # Check if endpoint requires authentication
             if not self._is_public_endpoint(path):
-                is_valid, auth_result = self._validate_api_security()
+                pipeline = _get_pipeline()
+                if pipeline is None:
+                    self._config_error()
+                    return
+                is_valid, auth_result = pipeline.authenticate(self.headers)
                 if not is_valid:
                     self._send_response(401, auth_result)
                     return
@@ -85,6 +121,7 @@ class handler(BaseHTTPRequestHandler):
                         "/analyze": "POST - Analyze location risks (requires auth)",
                         "/sea-level": "POST - Analyze sea level (requires auth)",
                         "/health": "GET - Health check (public)",
+                        "/metrics": "GET - Request and model routing metrics (requires auth)",
                         "/docs": "GET - API Documentation (public)"
                     },
                     "authentication": {
@@ -105,6 +142,9 @@ class handler(BaseHTTPRequestHandler):
             elif path == '/docs':
                 self._send_docs_page()
 
+            elif path == '/metrics':
+                self._send_response(200, _get_pipeline().metrics_snapshot())
+
             else:
                 self._send_response(404, {"error": "Route not found"})
 
@@ -116,126 +156,41 @@ class handler(BaseHTTPRequestHandler):
         try:
             parsed_path = urlparse(self.path)
             path = parsed_path.path
-
-            # Validate API security for all POST endpoints
-            is_valid, auth_result = self._validate_api_security()
-            if not is_valid:
-                self._send_response(401, auth_result)
+            body = self._read_body()
+            if body is None:
                 return
 
-            # Extract vendor info for logging/tracking
-            vendor_id = auth_result.get('vendor_id')
-
-            # Import services here to avoid module-level import issues
-            from src.location_risk_service import LocationRiskService
-            from src.sea_level_service import SeaLevelService
-            from src.config import Config
-
-            # Initialize services
-            config = Config()
-            risk_service = LocationRiskService(config)
-            sea_level_service = SeaLevelService(config)
-
-            # Parse request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                body = self.rfile.read(content_length).decode('utf-8')
-                try:
-                    body_data = json.loads(body)
-                except json.JSONDecodeError:
-                    self._send_response(
-                        400, {"error": "Invalid JSON in request body"})
-                    return
-            else:
-                body_data = {}
-
-            location = body_data.get('location', '').strip()
-            if not location:
-                self._send_response(400, {"error": "Location cannot be empty"})
+            pipeline = _get_pipeline()
+            if pipeline is None:
+                self._config_error()
                 return
 
-            if path == '/analyze':
-                try:
-                    risk_assessment = risk_service.analyze_location_risk(
-                        location)
-                    response_data = {
-                        "location": location,
-                        "risk_assessment": risk_assessment,
-                        "success": True,
-                        "error": None,
-                        "vendor_id": vendor_id,
-                        "timestamp": self._get_timestamp()
-                    }
-                    self._send_response(200, response_data)
-                except Exception as e:
-                    self._handle_service_error(
-                        e, location, "risk_assessment", vendor_id)
-
-            elif path == '/sea-level':
-                try:
-                    sea_level_assessment = sea_level_service.analyze_location_risk(
-                        location)
-                    response_data = {
-                        "location": location,
-                        "sea_level_assessment": sea_level_assessment,
-                        "success": True,
-                        "error": None,
-                        "vendor_id": vendor_id,
-                        "timestamp": self._get_timestamp()
-                    }
-                    self._send_response(200, response_data)
-                except Exception as e:
-                    self._handle_service_error(
-                        e, location, "sea_level_assessment", vendor_id)
-
-            else:
-                self._send_response(404, {"error": "Route not found"})
+            result = pipeline.handle(path, self.headers, body)
+            self._send_response(
+                result.status_code, result.payload, result.headers)
 
-        except ImportError as e:
-            self._send_response(500, {"error": f"Import error: {str(e)}"})
         except Exception as e:
             self._send_response(500, {"error": f"Server error: {str(e)}"})
 
-    def _handle_service_error(self, error, location, assessment_type, vendor_id=None):
-        """Handle service-specific errors"""
-        error_message = str(error)
-        if "401" in error_message or "invalid_api_key" in error_message:
-            status_code = 500
-            error_detail = "OpenAI API configuration error. Please check your API key."
-        elif "429" in error_message:
-            status_code = 429
-            error_detail = "Rate limit exceeded. Please try again later."
-        else:
-            status_code = 500
-            error_detail = f"Error analyzing location: {error_message}"
-
-        response_data = {
-            "location": location,
-            assessment_type: None,
-            "success": False,
-            "error": error_detail,
-            "vendor_id": vendor_id,
-            "timestamp": self._get_timestamp()
-        }
-        self._send_response(status_code, response_data)
-
-    def _get_timestamp(self):
-        """Get current timestamp in ISO format"""
-        from datetime import datetime
-        return datetime.utcnow().isoformat() + 'Z'
-
-    def _send_response(self, status_code, data):
+    def _send_response(self, status_code, data, headers=None):
         """Send JSON response"""
+        response_body = json.dumps(data, indent=2).encode('utf-8')
+
         self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers',
-                         'Content-Type, X-API-Key, X-Vendor-ID')
+                         'Content-Type, X-API-Key, X-Vendor-ID, X-Latency-Budget-Ms, '
+                         'X-Request-Deadline-Ms')
         self.end_headers()
 
-        response_json = json.dumps(data, indent=2)
-        self.wfile.write(response_json.encode('utf-8'))
+        self.wfile.write(response_body)
 
     def _send_docs_page(self):
         """Send HTML documentation page"""
@@ -398,17 +353,40 @@ X-Vendor-ID: [Valid Vendor ID Required]</pre>
 </html>
 """
 
+        response_body = html_content.encode('utf-8')
+
         self.send_response(200)
         self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(response_body)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(html_content.encode('utf-8'))
+        self.wfile.write(response_body)
 
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
+        if self._read_body() is None:
+            return
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers',
-                         'Content-Type, X-API-Key, X-Vendor-ID')
+                         'Content-Type, X-API-Key, X-Vendor-ID, X-Latency-Budget-Ms, '
+                         'X-Request-Deadline-Ms')
         self.end_headers()
+
+
+def main(host="0.0.0.0", port=8000):
+    """Run the handler as a standalone threaded server with keep-alive."""
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Standalone API server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
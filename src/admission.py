@@ -0,0 +1,230 @@
+"""
+Admission Control - Latency-adaptive concurrency limit and load shedding for the API
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional
+
+from starlette.datastructures import Headers
+
+from .metrics import metrics
+from .pipeline import RequestPipeline
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being queued or run."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds how many requests run at once and how long the rest may queue.
+
+    Up to ``limit`` requests run concurrently; the others wait in a FIFO queue
+    of at most ``max_queue`` entries. The limit adapts to observed latency
+    between ``min_in_flight`` and ``max_in_flight``: it grows by about one per
+    ``limit`` requests that finish within ``target_latency_seconds``, and
+    shrinks by 10% (at most once per target latency) when they finish slower.
+
+    A request is shed straight away, rather than queued, when the queue is
+    full or its expected wait - its queue position times the average latency
+    divided by the limit - is longer than ``max_wait_seconds`` or would leave
+    too little of its deadline to be served. Queued requests that are still
+    waiting after that long are shed too.
+
+    Not thread-safe: every method must run on the server's event loop.
+    """
+
+    def __init__(self, max_in_flight: int = 64, min_in_flight: int = 4,
+                 max_queue: int = 128, max_wait_seconds: float = 5.0,
+                 target_latency_seconds: float = 15.0):
+        """
+        Initialize the AdmissionController.
+
+        Args:
+            max_in_flight: Upper bound of the concurrency limit, and its start value
+            min_in_flight: Lower bound of the concurrency limit
+            max_queue: Requests allowed to wait for a slot
+            max_wait_seconds: Longest a request may wait for a slot
+            target_latency_seconds: Request latency above which the limit shrinks
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.min_in_flight = max(1, min(min_in_flight, self.max_in_flight))
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.target_latency_seconds = target_latency_seconds
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        self.latency = None
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    def expected_wait(self, position: int) -> float:
+        """Seconds a request at this queue position is expected to wait (Little's law)."""
+        if self.latency is None:
+            return 0.0
+        return position * self.latency / int(self.limit)
+
+    async def acquire(self, deadline_seconds: Optional[float] = None):
+        """
+        Wait for a slot, or shed the request.
+
+        Args:
+            deadline_seconds: Seconds the caller will wait in total, if known
+
+        Raises:
+            AdmissionRejected: If the request is shed
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        position = len(self._waiters) + 1
+        expected_wait = self.expected_wait(position)
+        if len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected("queue_full", expected_wait)
+
+        max_wait, reason = self.max_wait_seconds, "wait"
+        if deadline_seconds is not None:
+            # Leave the request enough of its deadline to actually be served
+            serve_by = deadline_seconds - (self.latency or 0.0)
+            if serve_by < max_wait:
+                max_wait, reason = serve_by, "deadline"
+        if max_wait <= 0 or expected_wait > max_wait:
+            raise AdmissionRejected(reason, expected_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self._discard(future)
+            raise AdmissionRejected(reason, self.expected_wait(len(self._waiters)))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # A slot was handed over just as the caller went away
+                self.release()
+            else:
+                self._discard(future)
+            raise
+
+    def release(self, latency: Optional[float] = None):
+        """
+        Free a slot and hand it to the next queued request.
+
+        Args:
+            latency: Seconds the request ran for, used to adapt the limit
+        """
+        self.in_flight -= 1
+        if latency is not None:
+            self._observe(latency)
+
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _observe(self, latency: float):
+        """Fold a request latency into the average and adjust the limit."""
+        self.latency = (latency if self.latency is None
+                        else 0.8 * self.latency + 0.2 * latency)
+
+        now = time.monotonic()
+        if latency > self.target_latency_seconds:
+            if now - self._last_decrease >= self.target_latency_seconds:
+                self._last_decrease = now
+                self.limit = max(float(self.min_in_flight), self.limit * 0.9)
+        else:
+            self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+
+    def _discard(self, future: asyncio.Future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the controller state as a JSON-serialisable dict."""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "avg_latency_seconds": self.latency,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that runs requests for the given paths through an
+    AdmissionController and answers shed requests with 503 + Retry-After.
+
+    Other paths - health checks, metrics, docs - bypass it entirely, so they
+    stay responsive while the controlled routes are saturated.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str]):
+        """
+        Initialize the AdmissionMiddleware.
+
+        Args:
+            app: Wrapped ASGI application
+            controller: AdmissionController shared by the controlled paths
+            paths: Request paths subject to admission control
+        """
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Queueing counts against the caller's deadline (see api._handle)
+        arrived_at = time.monotonic()
+        scope.setdefault("state", {})["arrived_at"] = arrived_at
+        try:
+            deadline_seconds = RequestPipeline.parse_deadline(Headers(scope=scope))
+        except ValueError:
+            deadline_seconds = None  # rejected with a 400 by the pipeline
+
+        try:
+            await self.controller.acquire(deadline_seconds)
+        except AdmissionRejected as e:
+            metrics.increment("requests_shed", path=scope["path"], reason=e.reason)
+            await self._reject(send, e)
+            return
+
+        admitted_at = time.monotonic()
+        metrics.increment("requests_admitted", path=scope["path"],
+                          queued=admitted_at - arrived_at > 0.001)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.monotonic() - admitted_at)
+
+    @staticmethod
+    async def _reject(send, error: AdmissionRejected):
+        body = json.dumps({
+            "detail": "Server is overloaded. Please retry later."
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after",
+                 str(max(1, math.ceil(error.retry_after))).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,19 +1,50 @@
 """
 Location Risks API - FastAPI endpoints for location risk assessment
 """
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Any
+import asyncio
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Union
 import uvicorn
 
-from .location_risk_service import LocationRiskService
+from .admission import AdmissionController, AdmissionMiddleware
+from .location_risk_service import HAZARDS, LocationRiskService
 from .sea_level_service import SeaLevelService
 from .config import Config
+from .deadline import Deadline, DeadlineExceeded, RequestCancelled
+from .jobs import GEOCODE_ENDPOINT, JobStore, JobWorkerPool
+from .metrics import metrics
+from .pipeline import PipelineResponse, RequestPipeline
+from .portfolio import PortfolioScorer, parse_properties
+from .profiling import sample_stacks
+from .spatial_index import AssessmentStore, SharedAssessmentStore, SpatialQuery
+
+
+# How often an in-flight request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
 
 
 class LocationRequest(BaseModel):
     """Request model for location risk analysis."""
     location: str
+    hazards: Optional[List[str]] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+class HazardResult(BaseModel):
+    """Assessment of a single hazard."""
+    assessment: str
+    model: str
+    score: Optional[int] = None
+    stale: bool = False
 
 
 class LocationResponse(BaseModel):
@@ -21,7 +52,14 @@ class LocationResponse(BaseModel):
     location: str
     risk_assessment: str
     success: bool
-    error: str = None
+    error: Optional[str] = None
+    vendor_id: Optional[str] = None
+    timestamp: Optional[str] = None
+    model: Optional[str] = None
+    stale: bool = False
+    hazards: Optional[Dict[str, HazardResult]] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 
 class SeaLevelRequest(BaseModel):
@@ -34,20 +72,146 @@ class SeaLevelResponse(BaseModel):
     location: str
     sea_level_assessment: str
     success: bool
-    error: str = None
+    error: Optional[str] = None
+    vendor_id: Optional[str] = None
+    timestamp: Optional[str] = None
+    model: Optional[str] = None
+    stale: bool = False
+
+
+class RiskQueryRequest(BaseModel):
+    """Request model for querying stored assessments by area and score."""
+    bbox: Optional[List[float]] = None
+    center: Optional[List[float]] = None
+    radius_km: Optional[float] = None
+    filters: Optional[Dict[str, Any]] = None
+    limit: int = 100
+
+
+class PortfolioProperty(BaseModel):
+    """A portfolio property, optionally with known coordinates."""
+    location: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+class PortfolioRequest(BaseModel):
+    """Request model for portfolio scoring."""
+    properties: List[Union[str, PortfolioProperty]]
+    hazards: Optional[List[str]] = None
+    top_n: int = Field(10, ge=0, le=1000)
+    include_properties: bool = True
+
+
+class JobRequest(BaseModel):
+    """Request model for submitting a batch job."""
+    locations: List[str]
+    endpoint: str = "/analyze"
+    hazards: Optional[List[str]] = None
+
+
+class JobAccepted(BaseModel):
+    """Response model for an accepted batch job."""
+    job_id: str
+    status: str
+    total: int
+
+
+# Initialize the services
+config = Config()
+risk_service = LocationRiskService(config)
+sea_level_service = SeaLevelService(config)
+if config.get_spatial_db_path():
+    assessment_store = SharedAssessmentStore(
+        config.get_spatial_db_path(), HAZARDS,
+        cell_degrees=config.get_spatial_cell_degrees())
+elif config.get_spatial_store_path():
+    assessment_store = AssessmentStore.load(
+        config.get_spatial_store_path(), HAZARDS,
+        cell_degrees=config.get_spatial_cell_degrees())
+else:
+    assessment_store = AssessmentStore(
+        HAZARDS, cell_degrees=config.get_spatial_cell_degrees())
+# The shared database is already durable; snapshots only back an in-memory index
+spatial_save_path = ("" if config.get_spatial_db_path()
+                     else config.get_spatial_store_path())
+pipeline = RequestPipeline(config, risk_service, sea_level_service,
+                           store=assessment_store)
+portfolio_scorer = PortfolioScorer(
+    pipeline,
+    workers=config.get_portfolio_workers(),
+    cluster_meters=config.get_portfolio_cluster_meters()
+)
+job_store = JobStore(
+    config.get_jobs_db_path(),
+    lease_seconds=config.get_job_lease_seconds(),
+    max_attempts=config.get_job_max_attempts()
+)
+job_workers = JobWorkerPool(
+    job_store, pipeline, workers=config.get_job_workers(),
+    geocoder=risk_service.geocoder,
+    on_job_complete=lambda job_id: portfolio_scorer.advance(job_store, job_id))
+admission = AdmissionController(**config.get_admission_settings())
+portfolio_admission = AdmissionController(
+    **config.get_portfolio_admission_settings())
+# One profile at a time; a second would only sample the first
+profile_admission = AdmissionController(
+    max_in_flight=1, min_in_flight=1, max_queue=0)
+
+
+async def save_spatial_index():
+    """Save the spatial index every SPATIAL_SAVE_SECONDS until cancelled."""
+    while True:
+        await asyncio.sleep(config.get_spatial_save_seconds())
+        try:
+            await run_in_threadpool(assessment_store.save, spatial_save_path)
+        except OSError:
+            metrics.increment("spatial_store_save_failures")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the job worker pool and periodically persist the spatial index."""
+    # Admitted requests each hold a threadpool thread; keep the pool from
+    # becoming a second, unbounded queue behind the admission controller
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(
+        limiter.total_tokens,
+        admission.max_in_flight + portfolio_admission.max_in_flight
+        + profile_admission.max_in_flight + 8)
+    if job_workers.workers > 0:
+        job_workers.start()
+    saver = (asyncio.create_task(save_spatial_index())
+             if spatial_save_path else None)
+    yield
+    if saver is not None:
+        saver.cancel()
+    job_workers.stop(timeout=5)
+    if spatial_save_path:
+        assessment_store.save(spatial_save_path)
 
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Location Risk Assessment API",
     description="API for assessing risks associated with specific locations using AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.add_middleware(AdmissionMiddleware, controller=admission,
+                   paths=list(pipeline.routes))
+app.add_middleware(AdmissionMiddleware, controller=portfolio_admission,
+                   paths=["/portfolio/score"])
+app.add_middleware(AdmissionMiddleware, controller=profile_admission,
+                   paths=["/debug/profile"])
 
-# Initialize the services
-config = Config()
-risk_service = LocationRiskService(config)
-sea_level_service = SeaLevelService(config)
+
+def _authenticate(http_request: Request) -> str:
+    """Return the caller's vendor ID or raise a 401 HTTPException."""
+    is_valid, auth_result = pipeline.authenticate(http_request.headers)
+    if not is_valid:
+        raise HTTPException(status_code=401, detail=auth_result.get("error"))
+    return auth_result["vendor_id"]
 
 
 @app.get("/")
@@ -59,7 +223,14 @@ async def root():
         "endpoints": {
             "/analyze": "POST - Analyze location risks",
             "/sea-level": "POST - Analyze sea level and distance to water",
-            "/health": "GET - Health check"
+            "/health": "GET - Health check",
+            "/metrics": "GET - Request and model routing metrics",
+            "/risk/query": "POST - Query stored assessments by area and hazard score",
+            "/portfolio/score": "POST - Score a portfolio with spatial deduplication and aggregates",
+            "/portfolio/jobs/{job_id}": "GET - Progress and results of a queued portfolio",
+            "/jobs": "POST - Submit a batch of locations for background processing",
+            "/jobs/{job_id}": "GET - Batch job progress and paginated results",
+            "/debug/profile": "GET - Stack-sampling profile of the serving worker"
         }
     }
 
@@ -70,113 +241,407 @@ async def health_check():
     return {"status": "healthy", "service": "location-risk-assessment"}
 
 
+@app.get("/metrics")
+async def get_metrics(http_request: Request) -> Dict[str, Any]:
+    """Request counters and the live latency/cost profile of every model."""
+    _authenticate(http_request)
+    snapshot = pipeline.metrics_snapshot()
+    snapshot["admission"] = admission.snapshot()
+    snapshot["portfolio_admission"] = portfolio_admission.snapshot()
+    # Counters are per worker process in multi-worker mode
+    snapshot["pid"] = os.getpid()
+    return snapshot
+
+
+@app.get("/debug/profile")
+async def debug_profile(http_request: Request,
+                        seconds: float = Query(5, gt=0),
+                        include_idle: bool = False,
+                        format: str = "json"):
+    """
+    Sample the stacks of every thread in the worker serving this request.
+
+    Args:
+        http_request: Raw request, used for the authentication headers
+        seconds: How long to sample for, up to DEBUG_PROFILE_MAX_SECONDS
+        include_idle: Keep samples of threads waiting for work
+        format: "json" for ranked frames and stacks, "collapsed" for
+            flame graph input ("frame;frame;frame count" per line)
+
+    Returns:
+        Profile of the worker, identified by its pid
+    """
+    _authenticate(http_request)
+    max_seconds = config.get_debug_profile_max_seconds()
+    if max_seconds <= 0:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if seconds > max_seconds:
+        raise HTTPException(
+            status_code=400,
+            detail=f"seconds must be at most {max_seconds:g}"
+        )
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400,
+                            detail="format must be 'json' or 'collapsed'")
+
+    profile = await run_in_threadpool(
+        sample_stacks, seconds, include_idle=include_idle,
+        top=None if format == "collapsed" else 50)
+    if format == "collapsed":
+        return PlainTextResponse("".join(
+            f"{entry['stack']} {entry['samples']}\n" for entry in profile["stacks"]))
+    return profile
+
+
+async def _run_cancellable(path: str, http_request: Request, func, *args,
+                           timeout: Optional[float] = None, **kwargs):
+    """
+    Run func(*args, deadline=..., **kwargs) off the event loop.
+
+    While it runs the client connection is polled; if the client disconnects
+    the request's Deadline is cancelled, so upstream completions still
+    streaming are closed and those not yet started are skipped.
+    """
+    deadline = Deadline(
+        timeout, started_at=getattr(http_request.state, "arrived_at", None))
+    task = asyncio.ensure_future(run_in_threadpool(
+        func, *args, deadline=deadline, **kwargs))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if not deadline.cancelled and await http_request.is_disconnected():
+            deadline.cancel()
+            metrics.increment("client_disconnects", path=path)
+
+
+async def _handle(path: str, http_request: Request,
+                  body: Dict[str, Any]) -> PipelineResponse:
+    """Run a request through the pipeline, cancelling it if the client goes away."""
+    return await _run_cancellable(
+        path, http_request, pipeline.handle, path, http_request.headers, body)
+
+
+def _render(result: PipelineResponse) -> Dict[str, Any]:
+    """Return a successful pipeline payload or raise the matching HTTPException."""
+    if not result.ok:
+        raise HTTPException(
+            status_code=result.status_code,
+            detail=result.payload.get("error"),
+            headers=result.headers or None
+        )
+    return result.payload
+
+
 @app.post("/sea-level", response_model=SeaLevelResponse)
-async def analyze_sea_level(request: SeaLevelRequest) -> SeaLevelResponse:
+async def analyze_sea_level(request: SeaLevelRequest, http_request: Request) -> SeaLevelResponse:
     """
     Analyze sea level and distance to water for a given location.
 
     Args:
         request: SeaLevelRequest containing the location string
+        http_request: Raw request, used for the authentication headers
 
     Returns:
         SeaLevelResponse with sea level assessment or error information
     """
-    try:
-        if not request.location or not request.location.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="Location cannot be empty"
-            )
-
-        # Analyze the sea level for the location
-        sea_level_assessment = sea_level_service.analyze_location_risk(
-            request.location.strip())
-
-        return SeaLevelResponse(
-            location=request.location.strip(),
-            sea_level_assessment=sea_level_assessment,
-            success=True
-        )
-
-    except Exception as e:
-        error_message = str(e)
-
-        # Handle specific OpenAI API errors
-        if "401" in error_message or "invalid_api_key" in error_message:
-            raise HTTPException(
-                status_code=500,
-                detail="OpenAI API configuration error. Please check your API key."
-            )
-        elif "429" in error_message:
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded. Please try again later."
-            )
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error analyzing sea level: {error_message}"
-            )
+    result = await _handle(
+        "/sea-level", http_request, {"location": request.location})
+    return SeaLevelResponse(**_render(result))
 
 
 @app.post("/analyze", response_model=LocationResponse)
-async def analyze_location(request: LocationRequest) -> LocationResponse:
+async def analyze_location(request: LocationRequest, http_request: Request) -> LocationResponse:
     """
     Analyze risks for a given location.
 
     Args:
         request: LocationRequest containing the location string
+        http_request: Raw request, used for the authentication headers
 
     Returns:
         LocationResponse with risk assessment or error information
     """
+    result = await _handle(
+        "/analyze", http_request,
+        {"location": request.location, "hazards": request.hazards,
+         "latitude": request.latitude, "longitude": request.longitude})
+    return LocationResponse(**_render(result))
+
+
+@app.post("/risk/query")
+async def query_risk(request: RiskQueryRequest, http_request: Request) -> Dict[str, Any]:
+    """
+    Query stored assessments inside an area, filtered by hazard scores.
+
+    Answers come from the in-memory spatial index, which first catches up
+    with assessments other workers recorded in SPATIAL_DB_PATH; no upstream
+    calls.
+
+    Args:
+        request: RiskQueryRequest with a bbox or center/radius_km and filters
+        http_request: Raw request, used for the authentication headers
+
+    Returns:
+        Total number of matches and up to ``limit`` matching locations
+    """
+    _authenticate(http_request)
     try:
-        if not request.location or not request.location.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="Location cannot be empty"
-            )
-
-        # Analyze the location
-        risk_assessment = risk_service.analyze_location_risk(
-            request.location.strip())
-
-        return LocationResponse(
-            location=request.location.strip(),
-            risk_assessment=risk_assessment,
-            success=True
+        query = SpatialQuery.from_dict({
+            "bbox": request.bbox,
+            "center": request.center,
+            "radius_km": request.radius_km,
+            "filters": request.filters,
+            "limit": request.limit
+        }, HAZARDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return await run_in_threadpool(assessment_store.query, query)
+
+
+@app.post("/portfolio/score")
+async def score_portfolio(request: PortfolioRequest, http_request: Request) -> Dict[str, Any]:
+    """
+    Score a portfolio, assessing each cluster of nearby properties once.
+
+    Up to PORTFOLIO_SYNC_MAX_GEOCODE distinct addresses without
+    coordinates are geocoded in the request, and portfolios of up to
+    PORTFOLIO_SYNC_MAX_CLUSTERS clusters are then scored in it too. Larger
+    ones are queued as a background job and answered with 202 and the id to
+    poll on GET /portfolio/jobs/{job_id}.
+
+    Args:
+        request: PortfolioRequest with the properties and optional hazards
+        http_request: Raw request, used for the authentication headers
+
+    Returns:
+        Per-property scores, per-hazard aggregates and the riskiest clusters
+    """
+    vendor_id = _authenticate(http_request)
+
+    if len(request.properties) > config.get_portfolio_max_properties():
+        raise HTTPException(
+            status_code=413,
+            detail=f"A portfolio may contain at most {config.get_portfolio_max_properties()} properties"
         )
 
-    except Exception as e:
-        error_message = str(e)
-
-        # Handle specific OpenAI API errors
-        if "401" in error_message or "invalid_api_key" in error_message:
-            raise HTTPException(
-                status_code=500,
-                detail="OpenAI API configuration error. Please check your API key."
-            )
-        elif "429" in error_message:
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded. Please try again later."
-            )
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error analyzing location: {error_message}"
-            )
-
-
-def run_server(host: str = "0.0.0.0", port: int = 8000, reload: bool = False):
-    """Run the FastAPI server."""
-    uvicorn.run(
-        "src.api:app",
-        host=host,
-        port=port,
-        reload=reload
-    )
+    try:
+        properties = parse_properties([
+            item if isinstance(item, str) else {
+                "location": item.location,
+                "latitude": item.latitude,
+                "longitude": item.longitude
+            }
+            for item in request.properties
+        ])
+        if not properties:
+            raise ValueError("properties must not be empty")
+        risk_service.parse_hazards(request.hazards)
+        timeout = RequestPipeline.parse_deadline(http_request.headers)
+        addresses = await run_in_threadpool(portfolio_scorer.addresses, properties)
+
+        if len(addresses) > config.get_portfolio_sync_max_geocode():
+            job_id = await run_in_threadpool(
+                portfolio_scorer.submit, job_store, properties, request.hazards,
+                request.top_n, request.include_properties, vendor_id)
+            return JSONResponse(status_code=202, content={
+                "job_id": job_id, "status": "queued", "stage": "geocoding",
+                "total": len(addresses)})
+
+        if addresses:
+            geocoded = await _run_cancellable(
+                "/portfolio/score", http_request, portfolio_scorer.geocode,
+                addresses, timeout=timeout)
+            properties = await run_in_threadpool(
+                portfolio_scorer.locate, properties, geocoded)
+        plan = await run_in_threadpool(portfolio_scorer.plan, properties)
+
+        if len(plan[0]) > config.get_portfolio_sync_max_clusters():
+            job_id = await run_in_threadpool(
+                portfolio_scorer.submit, job_store, properties, request.hazards,
+                request.top_n, request.include_properties, vendor_id, plan)
+            return JSONResponse(status_code=202, content={
+                "job_id": job_id, "status": "queued", "stage": "assessing",
+                "total": len(plan[0])})
+
+        return await _run_cancellable(
+            "/portfolio/score", http_request, portfolio_scorer.score,
+            properties, request.hazards, request.top_n,
+            request.include_properties, vendor_id, plan=plan, timeout=timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (DeadlineExceeded, RequestCancelled) as e:
+        status_code, detail = pipeline.classify_error(e, "portfolio")
+        raise HTTPException(status_code=status_code, detail=detail)
+
+
+@app.get("/portfolio/jobs/{job_id}")
+async def get_portfolio_job(job_id: str, http_request: Request) -> Dict[str, Any]:
+    """
+    Return a queued portfolio's progress, and its scores once complete.
+
+    Args:
+        job_id: Id returned by POST /portfolio/score
+        http_request: Raw request, used for the authentication headers
+
+    Returns:
+        Job status, stage ("geocoding" or "assessing") and the counters of
+        that stage; once every cluster is assessed, also the portfolio
+        response of POST /portfolio/score
+    """
+    vendor_id = _authenticate(http_request)
+
+    job = await run_in_threadpool(job_store.get_job, job_id, 0, 1)
+    if job is None or job["vendor_id"] != vendor_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["endpoint"] == GEOCODE_ENDPOINT and job["status"] == "completed":
+        # The worker finishing the geocoding normally queues the assessment;
+        # queue it here if that worker died first
+        next_job_id = job["next_job_id"] or await run_in_threadpool(
+            portfolio_scorer.advance, job_store, job_id)
+        if next_job_id is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job = await run_in_threadpool(job_store.get_job, next_job_id, 0, 1)
+
+    stage = "geocoding" if job["endpoint"] == GEOCODE_ENDPOINT else "assessing"
+    progress = {"job_id": job_id, "stage": stage}
+    progress.update({key: job[key] for key in
+                     ("status", "total", "completed", "failed", "progress")})
+    if job["status"] != "completed":
+        return progress
+
+    # Aggregates are computed from the stored item results once all are in
+    result = await run_in_threadpool(
+        portfolio_scorer.job_result, job_store, job["job_id"])
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {**progress, **result}
+
+
+@app.post("/jobs", response_model=JobAccepted, status_code=202)
+async def submit_job(request: JobRequest, http_request: Request) -> JobAccepted:
+    """
+    Queue a batch of locations for background processing.
+
+    Args:
+        request: JobRequest with the locations and the endpoint to run them against
+        http_request: Raw request, used for the authentication headers
+
+    Returns:
+        JobAccepted with the id to poll on GET /jobs/{job_id}
+    """
+    vendor_id = _authenticate(http_request)
+
+    if request.endpoint not in pipeline.routes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"endpoint must be one of: {', '.join(pipeline.routes)}"
+        )
+
+    locations = [location.strip() for location in request.locations]
+    if not locations or not all(locations):
+        raise HTTPException(
+            status_code=400,
+            detail="locations must be a non-empty list of non-empty strings"
+        )
+    if len(locations) > config.get_job_max_locations():
+        raise HTTPException(
+            status_code=413,
+            detail=f"A job may contain at most {config.get_job_max_locations()} locations"
+        )
+
+    try:
+        options = pipeline.parse_options(
+            request.endpoint, {"hazards": request.hazards})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job_id = await run_in_threadpool(
+        job_store.create_job, request.endpoint, locations, options, vendor_id)
+    return JobAccepted(job_id=job_id, status="queued", total=len(locations))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request,
+                  offset: int = Query(0, ge=0),
+                  limit: int = Query(100, ge=1, le=1000)) -> Dict[str, Any]:
+    """
+    Return a job's progress and one page of its results.
+
+    Args:
+        job_id: Id returned by POST /jobs
+        http_request: Raw request, used for the authentication headers
+        offset: Index of the first result to return
+        limit: Maximum number of results to return
+
+    Returns:
+        Job status, counters and the requested page of per-location results
+    """
+    vendor_id = _authenticate(http_request)
+
+    job = await run_in_threadpool(job_store.get_job, job_id, offset, limit)
+    if job is None or job["vendor_id"] != vendor_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def run_server(host: str = "0.0.0.0", port: int = 8000, reload: bool = False,
+               workers: Optional[int] = None):
+    """
+    Run the FastAPI server.
+
+    By default this is the production mode: uvicorn binds the socket once and
+    starts ``workers`` processes that all accept on it. Unless
+    SHARED_CACHE_PATH is set, a shared-memory cache segment is enabled for
+    them in a fresh private directory, removed again on exit, so a result
+    computed by one worker is served by all of them. Unless SPATIAL_DB_PATH
+    is set, the spatial index is likewise shared through a SQLite database
+    in that directory.
+    With ``reload=True`` a single auto-reloading development process is
+    started instead.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind
+        reload: Run one process that restarts on code changes
+        workers: Worker processes, defaults to SERVER_WORKERS
+
+    Raises:
+        ValueError: If more than one worker is requested while
+            SPATIAL_STORE_PATH is set without SPATIAL_DB_PATH
+    """
+    if reload:
+        uvicorn.run("src.api:app", host=host, port=port, reload=True)
+        return
+
+    workers = workers or config.get_server_workers()
+    if (workers > 1 and config.get_spatial_store_path()
+            and not config.get_spatial_db_path()):
+        # Each worker would hold its own index and save it over the others'
+        raise ValueError(
+            "SPATIAL_STORE_PATH requires a single server worker; set "
+            "SPATIAL_DB_PATH to share a persistent index between workers")
+    cache_dir = None
+    if workers > 1 and not (config.get_shared_cache_path()
+                            and config.get_spatial_db_path()):
+        # mkdtemp picks an unpredictable name and creates it mode 0700, so no
+        # other user can pre-create or read the segment or database; workers
+        # inherit the environment, so they all open the same files
+        cache_dir = tempfile.mkdtemp(
+            prefix="location-risks-",
+            dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        if not config.get_shared_cache_path():
+            os.environ["SHARED_CACHE_PATH"] = os.path.join(cache_dir, "cache")
+        if not config.get_spatial_db_path():
+            os.environ["SPATIAL_DB_PATH"] = os.path.join(cache_dir, "spatial.db")
+    try:
+        uvicorn.run("src.api:app", host=host, port=port, workers=workers)
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
-    run_server(reload=True)
+    run_server()
@@ -0,0 +1,224 @@
+"""
+Result Cache - In-memory TTL cache for assessment results
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from .metrics import metrics
+
+
+class ResultCache:
+    """
+    Thread-safe, size-bounded LRU cache whose entries expire after a TTL.
+
+    Expired entries are kept for a while longer so they can still be served
+    stale: for ``stale_while_revalidate`` seconds past their TTL while a
+    background refresh runs, and for ``stale_if_error`` seconds past their TTL
+    when recomputing them fails (e.g. the upstream circuit is open).
+
+    With a ``shared`` segment, every value is also written there, and keys
+    that are missing or expired locally are looked up there, so results
+    computed by one server worker are reused by the others.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 1024,
+                 stale_while_revalidate: float = 0, stale_if_error: float = 0,
+                 shared=None, namespace: str = "",
+                 encode: Optional[Callable[[Any], Any]] = None,
+                 decode: Optional[Callable[[Any], Any]] = None):
+        """
+        Initialize the ResultCache.
+
+        Args:
+            ttl_seconds: Default time-to-live for cached entries
+            max_entries: Maximum number of entries kept before evicting the
+                least recently used one
+            stale_while_revalidate: Seconds past expiry an entry is served
+                while it is refreshed in the background
+            stale_if_error: Seconds past expiry an entry is served when
+                recomputing it fails
+            shared: Optional SharedMemoryCache used as a cross-process tier
+            namespace: Prefix separating this cache's keys in the shared segment
+            encode: Converts a value to the JSON-serialisable form stored in
+                the shared segment, defaults to storing it as is
+            decode: Rebuilds a value read back from the shared segment
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.shared = shared
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_executor = None
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Return a cached value and how long ago it expired.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            (value, seconds past expiry) - negative while the entry is fresh -
+            or None if the key is missing or past every stale window
+        """
+        retention = max(self.stale_while_revalidate, self.stale_if_error)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                stale_for = time.monotonic() - expires_at
+                if stale_for < 0:
+                    self._entries.move_to_end(key)
+                    return value, stale_for
+
+        # Another worker may hold this key, or a fresher copy of it
+        if self.shared is not None:
+            found = self.shared.get((self.namespace, key))
+            if found is not None:
+                shared_stale_for = time.time() - found[1]
+                if shared_stale_for < retention and (
+                        entry is None or shared_stale_for < stale_for):
+                    metrics.increment("shared_cache_hits", namespace=self.namespace)
+                    value = found[0] if self.decode is None else self.decode(found[0])
+                    self._store(key, value, time.monotonic() - shared_stale_for)
+                    return value, shared_stale_for
+
+        if entry is None:
+            return None
+        with self._lock:
+            if stale_for >= retention:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return value, stale_for
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value for a key, or None if missing or expired.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None
+        """
+        entry = self.get_entry(key)
+        if entry is None or entry[1] >= 0:
+            return None
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value in the cache.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time-to-live in seconds, defaults to the cache-wide TTL
+        """
+        if ttl is None:
+            ttl = self.ttl_seconds
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        self._store(key, value, time.monotonic() + ttl)
+        if self.shared is not None:
+            self.shared.set(
+                (self.namespace, key),
+                value if self.encode is None else self.encode(value),
+                time.time() + ttl
+            )
+
+    def _store(self, key: Hashable, value: Any, expires_at: float):
+        """Insert a local entry expiring at a time.monotonic() timestamp."""
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def fetch(self, key: Hashable, loader: Callable[[], Any],
+              ttl: Optional[float] = None,
+              refresh_loader: Optional[Callable[[], Any]] = None) -> Tuple[Any, bool]:
+        """
+        Return a cached value, computing it with loader when needed.
+
+        Fresh entries are returned as-is. Entries within the
+        stale-while-revalidate window are returned immediately while loader
+        runs in the background. Otherwise loader runs inline; if it raises and
+        an entry within the stale-if-error window exists, that is returned
+        instead of the error.
+
+        Args:
+            key: Cache key
+            loader: Callable computing the value
+            ttl: Time-to-live for a newly computed value
+            refresh_loader: Callable used for background refreshes instead of
+                loader, e.g. one not bound to the calling request's deadline
+
+        Returns:
+            (value, stale) where stale is True if an expired entry was served
+        """
+        entry = self.get_entry(key)
+        if entry is not None:
+            value, stale_for = entry
+            if stale_for < 0:
+                return value, False
+            if stale_for < self.stale_while_revalidate:
+                self._refresh_in_background(key, refresh_loader or loader, ttl)
+                metrics.increment("cache_stale_served", reason="revalidate")
+                return value, True
+
+        try:
+            value = loader()
+        except Exception:
+            if entry is not None and entry[1] < self.stale_if_error:
+                metrics.increment("cache_stale_served", reason="error")
+                return entry[0], True
+            raise
+
+        self.set(key, value, ttl)
+        return value, False
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any],
+                               ttl: Optional[float]):
+        """Recompute an entry off the request path, once per key at a time."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=4, thread_name_prefix="cache-refresh")
+
+        def refresh():
+            try:
+                self.set(key, loader(), ttl)
+                metrics.increment("cache_refreshes", outcome="success")
+            except Exception:
+                metrics.increment("cache_refreshes", outcome="error")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_executor.submit(refresh)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
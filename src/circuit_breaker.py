@@ -0,0 +1,130 @@
+"""
+Circuit Breaker - Fail fast while the upstream model API is erroring or slow
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+from .metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open; upstream calls are paused")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent upstream calls and stops calling upstream
+    while too many of them fail or are slow.
+
+    The breaker is closed normally. When at least ``min_calls`` of the last
+    ``window`` calls have been recorded and the share of failed or slow calls
+    reaches ``failure_rate``, it opens and every call fails fast with
+    CircuitOpenError. After ``open_seconds`` it lets a single probe call
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 20.0, window: int = 20,
+                 min_calls: int = 10, open_seconds: float = 30.0):
+        """
+        Initialize the CircuitBreaker.
+
+        Args:
+            name: Name used in errors and metrics, e.g. "analyze"
+            failure_rate: Share of bad calls in the window that trips the circuit
+            slow_call_seconds: Calls slower than this count as bad
+            window: Number of recent calls considered
+            min_calls: Calls required in the window before it can trip
+            open_seconds: How long the circuit stays open before probing
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Check whether an upstream call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open or a probe is already running
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    metrics.increment("circuit_rejections", circuit=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self._set_state(self.HALF_OPEN)
+
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    metrics.increment("circuit_rejections", circuit=self.name)
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probe_in_flight = True
+
+    def record_success(self, latency: float):
+        """Record a completed call; slow calls count against the circuit."""
+        self._record(latency > self.slow_call_seconds)
+
+    def record_failure(self):
+        """Record a failed call."""
+        self._record(True)
+
+    def record_abandoned(self):
+        """
+        Release a call without counting it either way - one its caller gave
+        up on, or one that failed for a reason unrelated to upstream health
+        (e.g. a 400 or 401). A half-open probe slot is freed for the next call.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _record(self, bad: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                self._set_state(self.OPEN if bad else self.CLOSED)
+                return
+
+            self._outcomes.append(bad)
+            if (len(self._outcomes) >= self.min_calls and
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        """Transition to a new state; callers must hold the lock."""
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+        if state != self.HALF_OPEN:
+            self._outcomes.clear()
+        if state != self.state:
+            metrics.increment("circuit_transitions", circuit=self.name,
+                              state=state)
+        self.state = state
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the breaker state as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": sum(self._outcomes),
+            }
@@ -12,12 +12,160 @@ class Config:
         self.api_key = os.getenv("API_KEY", "4590afd6-c4ed-43f1-8f8d")
         self.vendor_id = os.getenv("VENDOR_ID", "c8w3e")
 
+        # Result Cache Configuration
+        self.cache_ttl_seconds = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+        self.cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+        self.cache_stale_while_revalidate = float(
+            os.getenv("CACHE_STALE_WHILE_REVALIDATE", "300"))
+        self.cache_stale_if_error = float(
+            os.getenv("CACHE_STALE_IF_ERROR", "86400"))
+        # Shared-memory segment used by every server worker ("" disables it)
+        self.shared_cache_path = os.getenv("SHARED_CACHE_PATH", "")
+        self.shared_cache_slots = int(os.getenv("SHARED_CACHE_SLOTS", "4096"))
+        self.shared_cache_slot_bytes = int(
+            os.getenv("SHARED_CACHE_SLOT_BYTES", "8192"))
+
+        # Circuit Breaker Configuration
+        self.breaker_settings = {
+            "failure_rate": float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+            "slow_call_seconds": float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20")),
+            "window": int(os.getenv("BREAKER_WINDOW", "20")),
+            "min_calls": int(os.getenv("BREAKER_MIN_CALLS", "10")),
+            "open_seconds": float(os.getenv("BREAKER_OPEN_SECONDS", "30")),
+        }
+        # Without a bound a hung upstream holds a call for the SDK default of
+        # 10 minutes per attempt before the breaker ever hears about it
+        self.upstream_timeout_seconds = float(os.getenv(
+            "UPSTREAM_TIMEOUT_SECONDS",
+            str(self.breaker_settings["slow_call_seconds"] * 1.5)))
+        self.upstream_max_retries = int(os.getenv("UPSTREAM_MAX_RETRIES", "1"))
+
+        # Admission Control Configuration
+        self.admission_settings = {
+            "max_in_flight": int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64")),
+            "min_in_flight": int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "4")),
+            "max_queue": int(os.getenv("ADMISSION_MAX_QUEUE", "128")),
+            "max_wait_seconds": float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "5")),
+            "target_latency_seconds": float(
+                os.getenv("ADMISSION_TARGET_LATENCY_SECONDS", "15")),
+        }
+        # Portfolio scoring fans out to many upstream calls per request, so
+        # it gets its own, much smaller limit
+        self.portfolio_admission_settings = {
+            "max_in_flight": int(os.getenv("PORTFOLIO_ADMISSION_MAX_IN_FLIGHT", "4")),
+            "min_in_flight": 1,
+            "max_queue": int(os.getenv("PORTFOLIO_ADMISSION_MAX_QUEUE", "8")),
+            "max_wait_seconds": self.admission_settings["max_wait_seconds"],
+            "target_latency_seconds": float(
+                os.getenv("PORTFOLIO_ADMISSION_TARGET_LATENCY_SECONDS", "60")),
+        }
+
+        # Model Routing Configuration (candidates listed preferred first)
+        self.model_settings = {
+            "analyze": {
+                "models": self._get_list(
+                    "RISK_MODELS", "gpt-4.1-2025-04-14,gpt-4.1-mini,gpt-4.1-nano"),
+                "temperature": float(os.getenv("RISK_TEMPERATURE", "0.7")),
+                # Per hazard: /analyze runs one small completion per hazard
+                "max_tokens": int(os.getenv("RISK_MAX_TOKENS", "150")),
+            },
+            "sea-level": {
+                "models": self._get_list(
+                    "SEA_LEVEL_MODELS", "gpt-3.5-turbo,gpt-4.1-nano"),
+                "temperature": float(os.getenv("SEA_LEVEL_TEMPERATURE", "0.2")),
+                "max_tokens": int(os.getenv("SEA_LEVEL_MAX_TOKENS", "500")),
+            },
+            "geocode": {
+                "models": self._get_list(
+                    "GEOCODE_MODELS", "gpt-4.1-mini,gpt-4.1-nano"),
+                "temperature": 0.0,
+                "max_tokens": 30,
+            },
+        }
+        # Explicit override; by default each router gets its own threshold,
+        # derived from the concurrency limits below
+        self.router_load_threshold = (
+            int(os.getenv("ROUTER_LOAD_THRESHOLD"))
+            if os.getenv("ROUTER_LOAD_THRESHOLD") else None)
+
+        # Per-Hazard Fan-out Configuration
+        self.hazard_ttl_seconds = {
+            hazard: float(os.getenv(f"HAZARD_TTL_{hazard.upper()}", default))
+            for hazard, default in [
+                ("flood", "604800"),
+                ("fire", "86400"),
+                ("burglary", "86400"),
+                ("storm", "21600"),
+                ("collapse", "2592000"),
+            ]
+        }
+
+        # Geocoding and Spatial Index Configuration
+        self.geocode_cache_ttl = float(
+            os.getenv("GEOCODE_CACHE_TTL", "2592000"))
+        self.spatial_cell_degrees = float(
+            os.getenv("SPATIAL_CELL_DEGREES", "0.1"))
+        self.spatial_store_path = os.getenv("SPATIAL_STORE_PATH", "")
+        self.spatial_save_seconds = float(
+            os.getenv("SPATIAL_SAVE_SECONDS", "300"))
+        self.spatial_db_path = os.getenv("SPATIAL_DB_PATH", "")
+
+        # Portfolio Scoring Configuration
+        self.portfolio_workers = int(os.getenv("PORTFOLIO_WORKERS", "16"))
+        self.portfolio_cluster_meters = float(
+            os.getenv("PORTFOLIO_CLUSTER_METERS", "100"))
+        self.portfolio_max_properties = int(
+            os.getenv("PORTFOLIO_MAX_PROPERTIES", "100000"))
+        self.portfolio_sync_max_geocode = int(
+            os.getenv("PORTFOLIO_SYNC_MAX_GEOCODE", "1000"))
+        self.portfolio_sync_max_clusters = int(
+            os.getenv("PORTFOLIO_SYNC_MAX_CLUSTERS", "200"))
+
+        # Job Queue Configuration
+        self.jobs_db_path = os.getenv("JOBS_DB_PATH", "jobs.db")
+        self.job_workers = int(os.getenv("JOB_WORKERS", "4"))
+        self.job_lease_seconds = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+        self.job_max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.job_max_locations = int(os.getenv("JOB_MAX_LOCATIONS", "100000"))
+
+        # Server Configuration
+        self.server_workers = int(
+            os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1)))
+        self.debug_profile_max_seconds = float(
+            os.getenv("DEBUG_PROFILE_MAX_SECONDS", "30"))
+
+        # Upstream Concurrency Configuration
+        # Every admitted request, job worker and portfolio worker runs at most
+        # one assessment at a time, each taking a hazard thread per hazard
+        # plus one for geocoding. The default pool fits all of them, so it
+        # never queues work behind the admission controller's back.
+        self.upstream_calls_per_assessment = len(self.hazard_ttl_seconds) + 1
+        assessment_callers = (self.admission_settings["max_in_flight"]
+                              + self.job_workers + self.portfolio_workers)
+        self.hazard_workers = int(
+            os.getenv("HAZARD_WORKERS")
+            or assessment_callers * self.upstream_calls_per_assessment)
+        # A smaller pool caps how many requests are admitted instead, so that
+        # requests wait, or are shed, in the admission queue and nowhere else
+        admittable = (self.hazard_workers // self.upstream_calls_per_assessment
+                      - self.job_workers - self.portfolio_workers)
+        admission = self.admission_settings
+        admission["max_in_flight"] = max(1, min(admission["max_in_flight"], admittable))
+        admission["min_in_flight"] = min(admission["min_in_flight"],
+                                         admission["max_in_flight"])
+
         if not self.openai_api_key:
             raise ValueError(
                 "OPENAI_API_KEY not found in environment variables. "
                 "Please create a .env file with your OpenAI API key."
             )
 
+    @staticmethod
+    def _get_list(name, default):
+        """Read a comma-separated environment variable as a list."""
+        value = os.getenv(name, default)
+        return [item.strip() for item in value.split(",") if item.strip()]
+
     def get_openai_api_key(self):
         """Return the OpenAI API key."""
         return self.openai_api_key
@@ -30,6 +178,148 @@ class Config:
         """Return the vendor ID for authentication."""
         return self.vendor_id
 
+    def get_cache_ttl_seconds(self):
+        """Return the time-to-live for cached assessment results."""
+        return self.cache_ttl_seconds
+
+    def get_cache_max_entries(self):
+        """Return the maximum number of cached assessment results."""
+        return self.cache_max_entries
+
+    def get_cache_stale_while_revalidate(self):
+        """Return how long past expiry a result is served while it refreshes."""
+        return self.cache_stale_while_revalidate
+
+    def get_cache_stale_if_error(self):
+        """Return how long past expiry a result is served when upstream fails."""
+        return self.cache_stale_if_error
+
+    def get_shared_cache_path(self):
+        """Return the shared-memory cache file, or "" when it is disabled."""
+        return self.shared_cache_path
+
+    def get_shared_cache_slots(self):
+        """Return the number of slots in the shared-memory cache."""
+        return self.shared_cache_slots
+
+    def get_shared_cache_slot_bytes(self):
+        """Return the size in bytes of each shared-memory cache slot."""
+        return self.shared_cache_slot_bytes
+
+    def get_breaker_settings(self):
+        """Return keyword arguments for the upstream circuit breakers."""
+        return self.breaker_settings
+
+    def get_openai_client_settings(self):
+        """Return keyword arguments bounding every OpenAI client's calls."""
+        return {
+            "timeout": self.upstream_timeout_seconds,
+            "max_retries": self.upstream_max_retries,
+        }
+
+    def get_admission_settings(self):
+        """Return keyword arguments for the API's admission controller."""
+        return self.admission_settings
+
+    def get_portfolio_admission_settings(self):
+        """Return keyword arguments for the portfolio scoring admission controller."""
+        return self.portfolio_admission_settings
+
+    def get_model_settings(self, endpoint):
+        """Return candidate models, temperature and max_tokens for an endpoint."""
+        return self.model_settings[endpoint]
+
+    def get_router_load_threshold(self, endpoint):
+        """
+        Return the in-flight call count at which a router drops to a faster model.
+
+        Unless ROUTER_LOAD_THRESHOLD is set, this is half the calls the
+        admitted requests can have in flight on that router, so it is
+        reached well before the admission limit is.
+        """
+        if self.router_load_threshold is not None:
+            return self.router_load_threshold
+        admitted = self.admission_settings["max_in_flight"]
+        if endpoint == "analyze":
+            admitted *= self.upstream_calls_per_assessment - 1
+        return max(1, admitted // 2)
+
+    def get_hazard_workers(self):
+        """Return the number of threads running per-hazard completions."""
+        return self.hazard_workers
+
+    def get_hazard_ttl_seconds(self, hazard):
+        """Return how long a single hazard's assessment stays cached."""
+        return self.hazard_ttl_seconds.get(hazard, self.cache_ttl_seconds)
+
+    def get_geocode_cache_ttl(self):
+        """Return how long geocoded coordinates stay cached."""
+        return self.geocode_cache_ttl
+
+    def get_spatial_cell_degrees(self):
+        """Return the grid cell size of the spatial assessment index."""
+        return self.spatial_cell_degrees
+
+    def get_spatial_store_path(self):
+        """Return the directory the spatial index is persisted to ("" for none)."""
+        return self.spatial_store_path
+
+    def get_spatial_save_seconds(self):
+        """Return how often the spatial index is saved to SPATIAL_STORE_PATH."""
+        return self.spatial_save_seconds
+
+    def get_spatial_db_path(self):
+        """Return the SQLite database sharing the spatial index between workers ("" for none)."""
+        return self.spatial_db_path
+
+    def get_portfolio_workers(self):
+        """Return the number of concurrent calls made while scoring a portfolio."""
+        return self.portfolio_workers
+
+    def get_portfolio_cluster_meters(self):
+        """Return the approximate width of a portfolio deduplication cluster."""
+        return self.portfolio_cluster_meters
+
+    def get_portfolio_max_properties(self):
+        """Return the maximum number of properties accepted in one portfolio."""
+        return self.portfolio_max_properties
+
+    def get_portfolio_sync_max_geocode(self):
+        """Return the most distinct addresses a portfolio request geocodes itself."""
+        return self.portfolio_sync_max_geocode
+
+    def get_portfolio_sync_max_clusters(self):
+        """Return the most clusters a portfolio may have to be scored in the request."""
+        return self.portfolio_sync_max_clusters
+
+    def get_jobs_db_path(self):
+        """Return the SQLite file backing the job queue."""
+        return self.jobs_db_path
+
+    def get_job_workers(self):
+        """Return the number of in-process job worker threads (0 disables them)."""
+        return self.job_workers
+
+    def get_job_lease_seconds(self):
+        """Return how long a worker may hold a job item before it is re-queued."""
+        return self.job_lease_seconds
+
+    def get_job_max_attempts(self):
+        """Return how many times a job item is tried before it is marked failed."""
+        return self.job_max_attempts
+
+    def get_job_max_locations(self):
+        """Return the maximum number of locations accepted in one job."""
+        return self.job_max_locations
+
+    def get_server_workers(self):
+        """Return the number of worker processes in production server mode."""
+        return self.server_workers
+
+    def get_debug_profile_max_seconds(self):
+        """Return the longest /debug/profile capture allowed (0 disables it)."""
+        return self.debug_profile_max_seconds
+
     def validate_credentials(self, provided_api_key, provided_vendor_id):
         """Validate provided credentials against configured values."""
         return (provided_api_key == self.api_key and
@@ -0,0 +1,79 @@
+"""
+Deadline - Per-request time limit and cancellation flag shared with upstream calls
+"""
+import threading
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work is done."""
+
+
+class RequestCancelled(Exception):
+    """Raised when the caller went away and the request's work was abandoned."""
+
+
+class Deadline:
+    """
+    Tracks how long a request may still run and whether it was cancelled.
+
+    One Deadline is created per request and passed down to every upstream
+    call made on its behalf, so calls that have not started yet are skipped
+    and calls in flight are cut short once it expires or is cancelled.
+    """
+
+    def __init__(self, timeout: Optional[float] = None,
+                 started_at: Optional[float] = None):
+        """
+        Initialize the Deadline.
+
+        Args:
+            timeout: Seconds from the start until the deadline, or None for no limit
+            started_at: time.monotonic() at which the request arrived,
+                defaults to now
+        """
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.expires_at = None
+        self._cancelled = threading.Event()
+        if timeout is not None:
+            self.shorten(timeout)
+
+    def shorten(self, timeout: float):
+        """Move the deadline to at most timeout seconds after the request arrived."""
+        expires_at = self.started_at + timeout
+        if self.expires_at is None or expires_at < self.expires_at:
+            self.expires_at = expires_at
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (never negative), or None if unbounded."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """True once the deadline has passed."""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cancel(self):
+        """Mark the request as abandoned, e.g. because the client disconnected."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """True once cancel() has been called."""
+        return self._cancelled.is_set()
+
+    def check(self):
+        """
+        Raise if the request should stop.
+
+        Raises:
+            RequestCancelled: If the request was cancelled
+            DeadlineExceeded: If the deadline has passed
+        """
+        if self.cancelled:
+            raise RequestCancelled("Request was cancelled by the client")
+        if self.expired:
+            raise DeadlineExceeded("Request deadline exceeded")
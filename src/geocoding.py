@@ -0,0 +1,113 @@
+"""
+Geocoding - Resolve location strings to coordinates using OpenAI API
+"""
+import re
+from typing import Optional, Tuple
+
+from .cache import ResultCache
+from .circuit_breaker import CircuitBreaker
+from .deadline import Deadline
+from .metrics import metrics
+from .model_router import ModelRouter
+from .shared_cache import get_shared_cache
+
+
+COORDINATES_PATTERN = re.compile(
+    r"(-?\d{1,3}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)")
+
+
+def parse_coordinates(text: str) -> Optional[Tuple[float, float]]:
+    """
+    Extract a "latitude, longitude" pair from model output.
+
+    Args:
+        text: Completion text
+
+    Returns:
+        (latitude, longitude), or None if no valid pair is found
+    """
+    match = COORDINATES_PATTERN.search(text or "")
+    if match is None:
+        return None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+class Geocoder:
+    """Resolves location strings to coordinates, caching every answer."""
+
+    def __init__(self, config, client):
+        """
+        Initialize the Geocoder.
+
+        Args:
+            config: Configuration object containing API keys and settings
+            client: OpenAI client shared with the calling service
+        """
+        self.config = config
+        self.client = client
+        self.cache = ResultCache(
+            ttl_seconds=config.get_geocode_cache_ttl(),
+            max_entries=config.get_cache_max_entries() * 10,
+            stale_if_error=config.get_cache_stale_if_error(),
+            shared=get_shared_cache(config),
+            namespace="geocode",
+            decode=tuple
+        )
+
+        settings = config.get_model_settings("geocode")
+        self.router = ModelRouter(
+            "geocode",
+            settings["models"],
+            temperature=settings["temperature"],
+            max_tokens=settings["max_tokens"],
+            load_threshold=config.get_router_load_threshold("geocode"),
+            breaker=CircuitBreaker("geocode", **config.get_breaker_settings())
+        )
+
+    def geocode(self, location: str,
+                deadline: Optional[Deadline] = None) -> Optional[Tuple[float, float]]:
+        """
+        Return the coordinates of a location.
+
+        Geocoding is best-effort: upstream errors and unparseable answers
+        return None rather than failing the caller's request.
+
+        Args:
+            location: The location to geocode (e.g., "San Francisco, CA")
+            deadline: Optional Deadline bounding the upstream call
+
+        Returns:
+            (latitude, longitude), or None if the location could not be resolved
+        """
+        try:
+            coordinates, _ = self.cache.fetch(
+                location.casefold(), lambda: self._geocode(location, deadline))
+        except Exception:
+            metrics.increment("geocode_failures")
+            return None
+        return coordinates
+
+    def _geocode(self, location: str,
+                 deadline: Optional[Deadline] = None) -> Tuple[float, float]:
+        prompt = f"""
+        Give the latitude and longitude of the following location: {location}
+
+        Answer with the two decimal numbers only, as "latitude, longitude".
+        """
+
+        completion = self.router.complete(
+            self.client,
+            [
+                {"role": "system", "content": "You are a geocoding assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            deadline=deadline
+        )
+
+        coordinates = parse_coordinates(completion.content)
+        if coordinates is None:
+            raise ValueError(f"Could not geocode location: {location}")
+        return coordinates
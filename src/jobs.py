@@ -0,0 +1,549 @@
+"""
+Jobs - SQLite-backed job queue and worker pool for long-running batches
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    vendor_id TEXT,
+    endpoint TEXT NOT NULL,
+    options TEXT NOT NULL,
+    metadata TEXT,
+    next_job_id TEXT,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    options TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    leased_until REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+-- Pending items are claimed in (available_at, rowid) order and expired
+-- leases found by leased_until, both straight off an index without sorting
+CREATE INDEX IF NOT EXISTS job_items_claim
+    ON job_items (status, available_at);
+CREATE INDEX IF NOT EXISTS job_items_lease
+    ON job_items (status, leased_until);
+"""
+
+# Columns added after the first release, created on databases that predate them
+ADDED_COLUMNS = [("jobs", "metadata TEXT"), ("jobs", "next_job_id TEXT"),
+                 ("job_items", "options TEXT")]
+
+# Endpoint of items that are only geocoded, not assessed; not a pipeline route
+GEOCODE_ENDPOINT = "/geocode"
+
+# Upstream statuses worth retrying; anything else fails the item immediately
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+
+
+class JobStore:
+    """
+    Persistent job queue in a local SQLite database.
+
+    Jobs are split into one row per location. Workers claim rows with a time
+    limited lease, so several threads or processes can drain the same queue
+    and rows held by a crashed worker become claimable again once their lease
+    expires.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300,
+                 max_attempts: int = 3):
+        """
+        Initialize the JobStore and create its tables if needed.
+
+        Args:
+            path: SQLite database file
+            lease_seconds: How long a claimed item is reserved for a worker
+            max_attempts: Attempts per item before it is marked as failed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            for table, column in ADDED_COLUMNS:
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column.split()[0] not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self, write: bool = True):
+        """
+        Open a connection and commit (or roll back) when the block exits.
+
+        Writers take the database write lock up front; readers get a
+        snapshot without blocking anyone (the database is in WAL mode).
+        """
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def create_job(self, endpoint: str, locations: List[str],
+                   options: Optional[Dict[str, Any]] = None,
+                   vendor_id: Optional[str] = None,
+                   item_options: Optional[List[Optional[Dict[str, Any]]]] = None,
+                   metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Store a new job and enqueue one item per location.
+
+        Args:
+            endpoint: Assessment route the items are run against
+            locations: Validated, non-empty location strings
+            options: Service options shared by every item
+            vendor_id: Vendor that owns the job
+            item_options: Per-item options, merged over options, parallel
+                to locations
+            metadata: Caller data kept with the job, see get_metadata
+
+        Returns:
+            The new job id
+        """
+        with self._connect() as conn:
+            return self._insert_job(conn, endpoint, locations, options,
+                                    vendor_id, item_options, metadata)
+
+    def chain_job(self, job_id: str, endpoint: str, locations: List[str],
+                  options: Optional[Dict[str, Any]] = None,
+                  vendor_id: Optional[str] = None,
+                  item_options: Optional[List[Optional[Dict[str, Any]]]] = None,
+                  metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Create the job that follows job_id, unless one already does.
+
+        The new job is linked as job_id's next_job_id in the same
+        transaction, so concurrent callers create it once.
+
+        Args:
+            job_id: Job the new one follows
+            endpoint, locations, options, vendor_id, item_options, metadata:
+                As for create_job
+
+        Returns:
+            The id of the job following job_id
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT next_job_id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row["next_job_id"] is not None:
+                return row["next_job_id"]
+            next_job_id = self._insert_job(conn, endpoint, locations, options,
+                                           vendor_id, item_options, metadata)
+            conn.execute("UPDATE jobs SET next_job_id = ? WHERE id = ?",
+                         (next_job_id, job_id))
+        return next_job_id
+
+    @staticmethod
+    def _insert_job(conn: sqlite3.Connection, endpoint: str,
+                    locations: List[str], options: Optional[Dict[str, Any]],
+                    vendor_id: Optional[str],
+                    item_options: Optional[List[Optional[Dict[str, Any]]]],
+                    metadata: Optional[Dict[str, Any]]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        item_options = item_options or [None] * len(locations)
+        conn.execute(
+            "INSERT INTO jobs (id, vendor_id, endpoint, options, metadata,"
+            " total, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, vendor_id, endpoint, json.dumps(options or {}),
+             json.dumps(metadata) if metadata is not None else None,
+             len(locations), now, now)
+        )
+        # Items become available in creation order, so claims are
+        # first-come first-served across jobs and retries
+        conn.executemany(
+            "INSERT INTO job_items (job_id, idx, location, options,"
+            " available_at) VALUES (?, ?, ?, ?, ?)",
+            [(job_id, idx, location,
+              json.dumps(extra) if extra else None, now)
+             for idx, (location, extra) in enumerate(zip(locations, item_options))]
+        )
+        metrics.increment("jobs_created", endpoint=endpoint)
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next runnable item.
+
+        Items whose lease expired after their last allowed attempt - their
+        worker crashed or hung on them every time - are failed, not re-leased.
+
+        Returns:
+            Dict with job_id, idx, location, endpoint, options, vendor_id and
+            attempts, or None if nothing is runnable
+        """
+        now = time.time()
+        with self._connect() as conn:
+            abandoned = conn.execute(
+                "SELECT job_id, COUNT(*) FROM job_items"
+                " WHERE status = 'running' AND leased_until < ? AND attempts >= ?"
+                " GROUP BY job_id",
+                (now, self.max_attempts)
+            ).fetchall()
+            if abandoned:
+                conn.execute(
+                    "UPDATE job_items SET status = 'error', leased_until = NULL,"
+                    " error = ? WHERE status = 'running' AND leased_until < ?"
+                    " AND attempts >= ?",
+                    (f"Worker lease expired on all {self.max_attempts} attempts",
+                     now, self.max_attempts)
+                )
+                conn.executemany(
+                    "UPDATE jobs SET failed = failed + ?, updated_at = ? WHERE id = ?",
+                    [(count, now, job_id) for job_id, count in abandoned]
+                )
+                metrics.increment("job_items_processed",
+                                  sum(count for _, count in abandoned),
+                                  status="error")
+
+            # Expired leases first - those items have waited longest - then
+            # the pending item that became available first
+            row = conn.execute(
+                "SELECT rowid, job_id, idx, location, attempts, options"
+                " FROM job_items WHERE status = 'running' AND leased_until < ?"
+                " ORDER BY leased_until LIMIT 1",
+                (now,)
+            ).fetchone() or conn.execute(
+                "SELECT rowid, job_id, idx, location, attempts, options"
+                " FROM job_items WHERE status = 'pending' AND available_at <= ?"
+                " ORDER BY available_at, rowid LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE job_items SET status = 'running', leased_until = ?,"
+                " attempts = attempts + 1 WHERE rowid = ?",
+                (now + self.lease_seconds, row["rowid"])
+            )
+            job = conn.execute(
+                "SELECT endpoint, options, vendor_id FROM jobs WHERE id = ?",
+                (row["job_id"],)
+            ).fetchone()
+
+        item = {key: row[key] for key in ("job_id", "idx", "location", "attempts")}
+        item.update(endpoint=job["endpoint"], options=job["options"],
+                    item_options=row["options"], vendor_id=job["vendor_id"])
+        item["options"] = json.loads(item["options"])
+        item["options"].update(json.loads(item.pop("item_options") or "{}"))
+        if "coordinates" in item["options"]:
+            item["options"]["coordinates"] = tuple(item["options"]["coordinates"])
+        item["attempts"] += 1
+        return item
+
+    def complete(self, job_id: str, idx: int, result: Dict[str, Any]) -> bool:
+        """Store a successful item result; return whether that finished the job."""
+        return self._finish(job_id, idx, "done", result=json.dumps(result))
+
+    def fail(self, job_id: str, idx: int, error: str, attempts: int,
+             retryable: bool = False) -> bool:
+        """
+        Record a failed attempt, re-queueing the item with backoff if allowed.
+
+        Args:
+            job_id: Job id
+            idx: Item index within the job
+            error: Error message to store if the item is given up on
+            attempts: Attempts made so far, including this one
+            retryable: Whether the error is transient
+
+        Returns:
+            Whether this finished the job (its last item was given up on)
+        """
+        if retryable and attempts < self.max_attempts:
+            with self._connect() as conn:
+                # Like _finish: an item re-claimed and finished elsewhere
+                # after this worker's lease expired must not be re-queued
+                updated = conn.execute(
+                    "UPDATE job_items SET status = 'pending', leased_until = NULL,"
+                    " available_at = ? WHERE job_id = ? AND idx = ?"
+                    " AND status = 'running'",
+                    (time.time() + 2 ** attempts, job_id, idx)
+                ).rowcount
+            if updated:
+                metrics.increment("job_item_retries")
+            return False
+        return self._finish(job_id, idx, "error", error=error)
+
+    def _finish(self, job_id: str, idx: int, status: str,
+                result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        counter = "completed" if status == "done" else "failed"
+        finished = False
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ?,"
+                " leased_until = NULL WHERE job_id = ? AND idx = ?"
+                " AND status = 'running'",
+                (status, result, error, job_id, idx)
+            ).rowcount
+            # A re-claimed item can finish twice; only count it once
+            if updated:
+                conn.execute(
+                    f"UPDATE jobs SET {counter} = {counter} + 1, updated_at = ?"
+                    " WHERE id = ?",
+                    (time.time(), job_id)
+                )
+                # Writers are serialised, so exactly one finisher sees this
+                finished = conn.execute(
+                    "SELECT completed + failed = total FROM jobs WHERE id = ?",
+                    (job_id,)
+                ).fetchone()[0] == 1
+        metrics.increment("job_items_processed", status=status)
+        return finished
+
+    def get_metadata(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the metadata stored with a job, or None if it has none."""
+        with self._connect(write=False) as conn:
+            row = conn.execute(
+                "SELECT metadata FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["metadata"] is None:
+            return None
+        return json.loads(row["metadata"])
+
+    def get_results(self, job_id: str) -> List[Dict[str, Any]]:
+        """
+        Return every item's outcome, in item order.
+
+        Args:
+            job_id: Job id
+
+        Returns:
+            List of dicts with status, result (None unless done) and error
+        """
+        with self._connect(write=False) as conn:
+            items = conn.execute(
+                "SELECT status, result, error FROM job_items WHERE job_id = ?"
+                " ORDER BY idx", (job_id,)
+            ).fetchall()
+        return [
+            {
+                "status": item["status"],
+                "result": json.loads(item["result"]) if item["result"] else None,
+                "error": item["error"],
+            }
+            for item in items
+        ]
+
+    def get_job(self, job_id: str, offset: int = 0,
+                limit: int = 100) -> Optional[Dict[str, Any]]:
+        """
+        Return a job's progress and one page of its item results.
+
+        Args:
+            job_id: Job id
+            offset: Index of the first item to return
+            limit: Maximum number of items to return
+
+        Returns:
+            Job status dict, or None if the job does not exist
+        """
+        with self._connect(write=False) as conn:
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            started = conn.execute(
+                "SELECT 1 FROM job_items WHERE job_id = ? AND status = 'running'"
+                " LIMIT 1", (job_id,)
+            ).fetchone() is not None
+            items = conn.execute(
+                "SELECT idx, location, status, result, error FROM job_items"
+                " WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                (job_id, offset, limit)
+            ).fetchall()
+
+        finished = job["completed"] + job["failed"]
+        if finished == job["total"]:
+            status = "completed"
+        elif finished or started:
+            status = "running"
+        else:
+            status = "queued"
+
+        next_offset = offset + len(items)
+        return {
+            "job_id": job["id"],
+            "vendor_id": job["vendor_id"],
+            "endpoint": job["endpoint"],
+            "next_job_id": job["next_job_id"],
+            "status": status,
+            "total": job["total"],
+            "completed": job["completed"],
+            "failed": job["failed"],
+            "progress": finished / job["total"] if job["total"] else 1.0,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": next_offset if next_offset < job["total"] else None,
+            "results": [
+                {
+                    "index": item["idx"],
+                    "location": item["location"],
+                    "status": item["status"],
+                    "result": json.loads(item["result"]) if item["result"] else None,
+                    "error": item["error"],
+                }
+                for item in items
+            ],
+        }
+
+
+class JobWorkerPool:
+    """Fixed pool of threads draining a JobStore through the request pipeline."""
+
+    def __init__(self, store: JobStore, pipeline, workers: int = 4,
+                 poll_interval: float = 1.0, geocoder=None,
+                 on_job_complete: Optional[Callable[[str], Any]] = None):
+        """
+        Initialize the JobWorkerPool.
+
+        Args:
+            store: Job queue to drain
+            pipeline: RequestPipeline used to run each item
+            workers: Number of concurrent worker threads
+            poll_interval: Seconds an idle worker sleeps before polling again
+            geocoder: Geocoder that runs GEOCODE_ENDPOINT items
+            on_job_complete: Called with a job's id by the worker that
+                finishes its last item
+        """
+        self.store = store
+        self.pipeline = pipeline
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.geocoder = geocoder
+        self.on_job_complete = on_job_complete
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads."""
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Signal the workers to stop and wait for them to finish their item."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self.store.claim()
+            except sqlite3.Error:
+                item = None
+            if item is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.process(item)
+
+    def process(self, item: Dict[str, Any]):
+        """Run one claimed item and record its outcome."""
+        try:
+            if item["endpoint"] == GEOCODE_ENDPOINT:
+                # Best-effort, as inside an assessment: an address that
+                # cannot be resolved completes without coordinates
+                ok, status_code = True, 200
+                payload = {"coordinates": self.geocoder.geocode(item["location"])}
+            else:
+                result = self.pipeline.assess(
+                    item["endpoint"], item["location"],
+                    options=item["options"], vendor_id=item["vendor_id"])
+                ok, status_code, payload = result.ok, result.status_code, result.payload
+        except Exception as e:
+            finished = self.store.fail(item["job_id"], item["idx"], str(e),
+                                       item["attempts"])
+        else:
+            if ok:
+                finished = self.store.complete(item["job_id"], item["idx"], payload)
+            else:
+                finished = self.store.fail(
+                    item["job_id"], item["idx"], payload.get("error"),
+                    item["attempts"],
+                    retryable=status_code in RETRYABLE_STATUS_CODES)
+
+        if finished and self.on_job_complete is not None:
+            try:
+                self.on_job_complete(item["job_id"])
+            except Exception:
+                # Whoever reads the job next can retry the follow-up work
+                metrics.increment("job_hook_failures")
+
+
+def main():
+    """Run a worker-only process that drains the job queue."""
+    from .config import Config
+    from .location_risk_service import LocationRiskService
+    from .pipeline import RequestPipeline
+    from .portfolio import PortfolioScorer
+    from .sea_level_service import SeaLevelService
+
+    config = Config()
+    risk_service = LocationRiskService(config)
+    pipeline = RequestPipeline(config, risk_service, SeaLevelService(config))
+    store = JobStore(config.get_jobs_db_path(),
+                     lease_seconds=config.get_job_lease_seconds(),
+                     max_attempts=config.get_job_max_attempts())
+    # Portfolios geocoded by a job are planned and queued for assessment here
+    scorer = PortfolioScorer(
+        pipeline,
+        workers=config.get_portfolio_workers(),
+        cluster_meters=config.get_portfolio_cluster_meters())
+    pool = JobWorkerPool(
+        store,
+        pipeline,
+        workers=config.get_job_workers(),
+        geocoder=risk_service.geocoder,
+        on_job_complete=lambda job_id: scorer.advance(store, job_id)
+    )
+    print(f"Draining job queue at {config.get_jobs_db_path()} "
+          f"with {config.get_job_workers()} workers")
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,193 @@
 """
 Location Risk Service - Core logic for assessing location-based risks
 """
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
 from openai import OpenAI
 
+from .cache import ResultCache
+from .circuit_breaker import CircuitBreaker
+from .deadline import Deadline
+from .geocoding import Geocoder
+from .model_router import ModelRouter, RoutedCompletion
+from .shared_cache import get_shared_cache
+
+
+# Hazard name -> what the per-hazard completion is asked to assess
+HAZARDS = {
+    "flood": "Floods disaster risks",
+    "fire": "Fire-related risks",
+    "burglary": "Burglaries and theft risks",
+    "storm": "Storm-related risks",
+    "collapse": "Collapse risks",
+}
+
+SCORE_PATTERN = re.compile(
+    r"^\W*risk score\W*(\d+(?:\.\d+)?)(?:\s*/\s*10)?\W*$",
+    re.IGNORECASE | re.MULTILINE)
+
+
+def split_score(text: str) -> Tuple[str, Optional[int]]:
+    """
+    Separate the trailing "Risk score: N" line from a hazard assessment.
+
+    Args:
+        text: Completion text
+
+    Returns:
+        (assessment without the score line, score from 0 to 10 or None)
+    """
+    match = SCORE_PATTERN.search(text or "")
+    if match is None:
+        return text, None
+    score = min(10, max(0, round(float(match.group(1)))))
+    return (text[:match.start()] + text[match.end():]).strip(), score
+
+
+class HazardResult(RoutedCompletion):
+    """Completion for a single hazard, with its parsed 0-10 risk score."""
+
+    def __init__(self, completion: RoutedCompletion):
+        content, self.score = split_score(completion.content)
+        super().__init__(content, completion.model, completion.latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serialisable form of the result, read by from_dict."""
+        return {"content": self.content, "model": self.model,
+                "latency": self.latency, "score": self.score}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HazardResult":
+        """Rebuild a result from to_dict output."""
+        result = cls.__new__(cls)
+        RoutedCompletion.__init__(result, data["content"], data["model"],
+                                  data["latency"])
+        result.score = data["score"]
+        return result
+
+
+class RiskAssessment:
+    """Combined result of the per-hazard completions for one location."""
+
+    def __init__(self, hazards: Dict[str, HazardResult],
+                 stale_hazards: Optional[Set[str]] = None,
+                 coordinates: Optional[Tuple[float, float]] = None):
+        """
+        Initialize the RiskAssessment.
+
+        Args:
+            hazards: Result for each requested hazard, in request order
+            stale_hazards: Hazards served from an expired cache entry
+            coordinates: (latitude, longitude) of the location, if known
+        """
+        self.hazards = hazards
+        self.stale_hazards = stale_hazards or set()
+        self.coordinates = coordinates
+
+    @property
+    def scores(self) -> Dict[str, Optional[int]]:
+        """0-10 risk score per hazard (None where the model gave none)."""
+        return {name: result.score for name, result in self.hazards.items()}
+
+    @property
+    def stale(self) -> bool:
+        """True if any hazard was served from an expired cache entry."""
+        return bool(self.stale_hazards)
+
+    @property
+    def content(self) -> str:
+        """Numbered prose assessment covering every requested hazard."""
+        return "\n\n".join(
+            f"{index}. {HAZARDS[name]}:\n{completion.content.strip()}"
+            for index, (name, completion) in enumerate(self.hazards.items(), 1)
+        )
+
+    @property
+    def model(self) -> str:
+        """Model(s) that produced the assessment, comma-separated if mixed."""
+        models = []
+        for completion in self.hazards.values():
+            if completion.model not in models:
+                models.append(completion.model)
+        return ", ".join(models)
+
 
 class LocationRiskService:
     """Service class for analyzing location risks using OpenAI API."""
 
-    def __init__(self, config):
+    HAZARDS = HAZARDS
+
+    def __init__(self, config, cache: Optional[ResultCache] = None,
+                 geocoder: Optional[Geocoder] = None):
         """
         Initialize the LocationRiskService.
 
         Args:
             config: Configuration object containing API keys and settings
+            cache: Optional per-hazard result cache, created from config when omitted
+            geocoder: Optional geocoder, created from config when omitted
         """
         self.config = config
-        self.client = OpenAI(api_key=config.get_openai_api_key())
+        self.client = OpenAI(api_key=config.get_openai_api_key(),
+                             **config.get_openai_client_settings())
+        self.geocoder = geocoder if geocoder is not None else Geocoder(
+            config, self.client)
+        self.cache = cache if cache is not None else ResultCache(
+            max_entries=config.get_cache_max_entries(),
+            stale_while_revalidate=config.get_cache_stale_while_revalidate(),
+            stale_if_error=config.get_cache_stale_if_error(),
+            shared=get_shared_cache(config),
+            namespace="hazard",
+            encode=HazardResult.to_dict,
+            decode=HazardResult.from_dict
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.get_hazard_workers(),
+            thread_name_prefix="hazard"
+        )
+
+        settings = config.get_model_settings("analyze")
+        self.router = ModelRouter(
+            "analyze",
+            settings["models"],
+            temperature=settings["temperature"],
+            max_tokens=settings["max_tokens"],
+            load_threshold=config.get_router_load_threshold("analyze"),
+            breaker=CircuitBreaker("analyze", **config.get_breaker_settings())
+        )
+
+    @staticmethod
+    def parse_hazards(hazards) -> List[str]:
+        """
+        Validate a caller-supplied hazard selection.
+
+        Args:
+            hazards: List of hazard names, or None for all hazards
+
+        Returns:
+            The selected hazard names, de-duplicated, in request order
+
+        Raises:
+            ValueError: If the selection is empty or names an unknown hazard
+        """
+        if hazards is None:
+            return list(HAZARDS)
+        if not isinstance(hazards, list) or not hazards:
+            raise ValueError(
+                f"hazards must be a non-empty list drawn from: {', '.join(HAZARDS)}")
+
+        selected = []
+        for name in hazards:
+            key = str(name).strip().lower()
+            if key not in HAZARDS:
+                raise ValueError(
+                    f"Unknown hazard '{name}'. Valid hazards: {', '.join(HAZARDS)}")
+            if key not in selected:
+                selected.append(key)
+        return selected
 
     def analyze_location_risk(self, location: str) -> str:
         """
@@ -26,32 +198,94 @@ class LocationRiskService:
 
         Returns:
             A string containing the risk assessment
+
+        Raises:
+            openai.OpenAIError: If the upstream completion request fails
+        """
+        return self.analyze(location).content
+
+    def analyze(self, location: str, latency_budget: Optional[float] = None,
+                hazards: Optional[List[str]] = None,
+                coordinates: Optional[Tuple[float, float]] = None,
+                deadline: Optional[Deadline] = None,
+                geocode: bool = True) -> RiskAssessment:
+        """
+        Analyze a location, one concurrent completion per hazard.
+
+        Hazards with a fresh cached result are not re-run, so a request after
+        a hazard's TTL expires only refreshes the stale hazards. Recently
+        expired hazards, and any retained hazard while upstream is failing,
+        are served stale (see ResultCache.fetch).
+
+        Args:
+            location: The location to analyze (e.g., "San Francisco, CA")
+            latency_budget: Seconds the caller can wait, or None for no limit
+            hazards: Hazard names to assess, or None for all hazards
+            coordinates: Known (latitude, longitude); geocoded concurrently
+                with the hazards when omitted
+            deadline: Optional Deadline bounding every upstream call made for
+                this request; background refreshes are not bound to it
+            geocode: Whether to geocode the location when coordinates are
+                not given; without it the result has no coordinates
+
+        Returns:
+            RiskAssessment with the per-hazard results and coordinates
+
+        Raises:
+            ValueError: If hazards names an unknown hazard
+            CircuitOpenError: If upstream is unavailable and nothing is cached
+            DeadlineExceeded: If the deadline passes and nothing is cached
+            RequestCancelled: If the request is cancelled and nothing is cached
+            openai.OpenAIError: If an upstream completion request fails
         """
-        try:
-            prompt = f"""
-            Analyze the potential risks for the following location: {location}
-            
-            Please provide a brief assessment covering:
-            1. Floods disaster risks
-            2. Fire-related risks
-            3. Burglaries and theft risks
-            4. Storm-related risks
-            5. Collapse risks
-            
-            Keep the response concise and informative.
-            """
-
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-2025-04-14",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that provides location risk assessments."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
+        selected = self.parse_hazards(hazards)
+
+        geocoding = None
+        if coordinates is None and geocode:
+            geocoding = self.executor.submit(
+                self.geocoder.geocode, location, deadline)
+
+        futures = {
+            name: self.executor.submit(
+                self.cache.fetch,
+                ("hazard", name, location.casefold()),
+                partial(self._analyze_hazard, name, location, latency_budget,
+                        deadline),
+                self.config.get_hazard_ttl_seconds(name),
+                partial(self._analyze_hazard, name, location, latency_budget)
             )
+            for name in selected
+        }
+
+        results = {}
+        stale_hazards = set()
+        for name, future in futures.items():
+            results[name], stale = future.result()
+            if stale:
+                stale_hazards.add(name)
 
-            return response.choices[0].message.content
+        if geocoding is not None:
+            coordinates = geocoding.result()
+        return RiskAssessment(results, stale_hazards, coordinates)
+
+    def _analyze_hazard(self, hazard: str, location: str,
+                        latency_budget: Optional[float],
+                        deadline: Optional[Deadline] = None) -> HazardResult:
+        """Run the token-capped completion for a single hazard."""
+        prompt = f"""
+        Analyze the {HAZARDS[hazard].lower()} for the following location: {location}
+
+        Keep the response to a few concise, informative sentences.
+        End with a final line of the form "Risk score: N", where N is an
+        integer from 0 (no risk) to 10 (extreme risk).
+        """
 
-        except Exception as e:
-            return f"Error analyzing location: {str(e)}"
+        return HazardResult(self.router.complete(
+            self.client,
+            [
+                {"role": "system", "content": "You are a helpful assistant that provides location risk assessments."},
+                {"role": "user", "content": prompt}
+            ],
+            latency_budget=latency_budget,
+            deadline=deadline
+        ))
@@ -0,0 +1,49 @@
+"""
+Metrics - Process-wide counters for the location risk services
+"""
+import threading
+from typing import Any, Dict
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> str:
+        if not labels:
+            return name
+        label_str = ",".join(
+            f"{key}={value}" for key, value in sorted(labels.items()))
+        return f"{name}{{{label_str}}}"
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """
+        Increment a counter.
+
+        Args:
+            name: Counter name, e.g. "model_requests"
+            amount: Amount to add
+            **labels: Label values distinguishing series of the same counter
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def get(self, name: str, **labels) -> float:
+        """Return the current value of a counter (0 if never incremented)."""
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Return a copy of all counters."""
+        with self._lock:
+            return dict(self._counters)
+
+
+# Shared registry used by services and both server stacks
+metrics = Metrics()
@@ -0,0 +1,334 @@
+"""
+Model Router - Latency-budget aware model selection with live latency/cost profiles
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import openai
+
+from .circuit_breaker import CircuitBreaker
+from .deadline import Deadline, DeadlineExceeded, RequestCancelled
+from .metrics import metrics
+
+
+# Approximate USD prices per 1K (prompt, completion) tokens. Models missing
+# from the table are still routed, they just report no cost.
+MODEL_PRICES = {
+    "gpt-4.1-2025-04-14": (0.002, 0.008),
+    "gpt-4.1": (0.002, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+    "gpt-4.1-nano": (0.0001, 0.0004),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Return True for upstream errors that say nothing about the request itself:
+    timeouts, connection errors, 408/409/429 and 5xx responses.
+
+    Client errors (400 bad request, 401 auth, 404 unknown model) are not
+    transient; retrying or tripping a circuit breaker would only hide them.
+    """
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(error, (openai.APIConnectionError, TimeoutError,
+                              ConnectionError))
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class ModelProfile:
+    """Latency and cost profile for one candidate model, learned from live calls."""
+
+    def __init__(self, name: str, window: int = 200):
+        """
+        Initialize the ModelProfile.
+
+        Args:
+            name: OpenAI model name
+            window: Number of recent calls the percentiles are computed over
+        """
+        self.name = name
+        self.prices = MODEL_PRICES.get(name)
+        self.calls = 0
+        self.total_cost = 0.0
+        self.p50 = None
+        self.p95 = None
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, usage=None):
+        """
+        Record a completed call.
+
+        Args:
+            latency: Wall-clock duration of the call in seconds
+            usage: Optional token usage object from the completion response
+        """
+        cost = self.estimate_cost(usage)
+        with self._lock:
+            self.calls += 1
+            self.total_cost += cost or 0.0
+            self._latencies.append(latency)
+            ordered = sorted(self._latencies)
+            self.p50 = _percentile(ordered, 0.50)
+            self.p95 = _percentile(ordered, 0.95)
+
+    def estimate_cost(self, usage) -> Optional[float]:
+        """Return the USD cost of a call from its token usage, if known."""
+        if usage is None or self.prices is None:
+            return None
+        prompt_price, completion_price = self.prices
+        return (getattr(usage, "prompt_tokens", 0) * prompt_price +
+                getattr(usage, "completion_tokens", 0) * completion_price) / 1000
+
+    def fits(self, latency_budget: Optional[float]) -> bool:
+        """Return True if the model's p95 latency fits within the budget."""
+        if latency_budget is None or self.p95 is None:
+            return True
+        return self.p95 <= latency_budget
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the profile as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "p50_seconds": self.p50,
+                "p95_seconds": self.p95,
+                "avg_cost_usd": (self.total_cost / self.calls
+                                 if self.calls and self.prices else None),
+            }
+
+
+class RoutedCompletion:
+    """Result of a routed completion call."""
+
+    def __init__(self, content: str, model: str, latency: float):
+        self.content = content
+        self.model = model
+        self.latency = latency
+
+
+class ModelRouter:
+    """
+    Chooses a model for each completion from an ordered list of candidates.
+
+    Candidates are listed from preferred (highest quality) to fallback
+    (cheapest, fastest). The router starts from the preferred model, skips it
+    while the number of in-flight calls is at or above the load threshold,
+    and then takes the first candidate whose observed p95 latency fits the
+    request's latency budget. If none fit, the candidate with the lowest
+    observed p50 is used.
+
+    Every call goes through the router's circuit breaker, so while upstream
+    is failing or slow calls fail fast with CircuitOpenError.
+    """
+
+    def __init__(self, endpoint: str, models: List[str], temperature: float,
+                 max_tokens: int, load_threshold: int = 8,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the ModelRouter.
+
+        Args:
+            endpoint: Name used to label metrics, e.g. "analyze"
+            models: Candidate model names, preferred first
+            temperature: Sampling temperature passed to every candidate
+            max_tokens: Completion token cap passed to every candidate
+            load_threshold: In-flight calls at which the preferred model is skipped
+            breaker: Circuit breaker guarding upstream calls, one with default
+                settings is created when omitted
+        """
+        if not models:
+            raise ValueError(f"No candidate models configured for {endpoint}")
+
+        self.endpoint = endpoint
+        self.profiles = [ModelProfile(name) for name in models]
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.load_threshold = load_threshold
+        self.breaker = breaker if breaker is not None else CircuitBreaker(endpoint)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def select(self, latency_budget: Optional[float] = None) -> ModelProfile:
+        """
+        Pick the candidate model for a call.
+
+        Args:
+            latency_budget: Seconds the caller can wait, or None for no limit
+
+        Returns:
+            The selected ModelProfile
+        """
+        candidates = self.profiles
+        if len(candidates) > 1 and self.in_flight >= self.load_threshold:
+            candidates = candidates[1:]
+
+        for profile in candidates:
+            if profile.fits(latency_budget):
+                return profile
+
+        return min(candidates, key=lambda p: p.p50 if p.p50 is not None else 0.0)
+
+    def complete(self, client, messages: List[Dict[str, str]],
+                 latency_budget: Optional[float] = None,
+                 deadline: Optional[Deadline] = None, **kwargs) -> RoutedCompletion:
+        """
+        Run a chat completion on the selected model and record its latency.
+
+        With a deadline, the call is skipped if the deadline has already
+        passed or the request was cancelled, its remaining time is passed to
+        OpenAI as the request timeout and caps the latency budget, and the
+        completion is streamed so it can be abandoned between chunks - which
+        closes the connection and stops generation upstream.
+
+        Args:
+            client: OpenAI client
+            messages: Chat messages
+            latency_budget: Seconds the caller can wait, or None for no limit
+            deadline: Optional Deadline of the request the call is made for
+            **kwargs: Extra arguments passed to chat.completions.create
+
+        Returns:
+            RoutedCompletion with the response text and the model used
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open
+            DeadlineExceeded: If the deadline passes before the call completes
+            RequestCancelled: If the request is cancelled before the call completes
+        """
+        if deadline is not None:
+            try:
+                deadline.check()
+            except (DeadlineExceeded, RequestCancelled) as e:
+                self._record_abandoned(e, "before_call")
+                raise
+            remaining = deadline.remaining()
+            if remaining is not None:
+                latency_budget = (remaining if latency_budget is None
+                                  else min(latency_budget, remaining))
+
+        self.breaker.before_call()
+        profile = self.select(latency_budget)
+        kwargs.setdefault("temperature", self.temperature)
+        kwargs.setdefault("max_tokens", self.max_tokens)
+
+        with self._lock:
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            if deadline is None:
+                response = client.chat.completions.create(
+                    model=profile.name,
+                    messages=messages,
+                    **kwargs
+                )
+                content = response.choices[0].message.content
+                usage = getattr(response, "usage", None)
+            else:
+                content, usage = self._stream(
+                    client, profile.name, messages, deadline, **kwargs)
+        except (DeadlineExceeded, RequestCancelled) as e:
+            # Abandoned on the caller's behalf - not an upstream failure
+            self.breaker.record_abandoned()
+            self._record_abandoned(e, "in_flight", kwargs["max_tokens"])
+            raise
+        except Exception as e:
+            if deadline is not None and (deadline.expired or deadline.cancelled):
+                # The OpenAI timeout fired because the caller's deadline passed
+                self.breaker.record_abandoned()
+                self._record_abandoned(DeadlineExceeded(), "in_flight",
+                                       kwargs["max_tokens"])
+                raise DeadlineExceeded("Request deadline exceeded") from e
+            if is_transient_error(e):
+                self.breaker.record_failure()
+            else:
+                # Not the upstream's health; let the error surface as is
+                self.breaker.record_abandoned()
+            metrics.increment("model_errors", endpoint=self.endpoint,
+                              model=profile.name)
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        latency = time.monotonic() - start
+        self.breaker.record_success(latency)
+        profile.record(latency, usage)
+        metrics.increment("model_requests", endpoint=self.endpoint,
+                          model=profile.name)
+        if profile is not self.profiles[0]:
+            metrics.increment("model_fallbacks", endpoint=self.endpoint,
+                              model=profile.name)
+
+        return RoutedCompletion(content, profile.name, latency)
+
+    @staticmethod
+    def _stream(client, model: str, messages: List[Dict[str, str]],
+                deadline: Deadline, **kwargs) -> Tuple[str, Any]:
+        """
+        Stream a completion, abandoning it as soon as the deadline stops it.
+
+        Returns:
+            (content, usage)
+        """
+        remaining = deadline.remaining()
+        timeout = getattr(client, "timeout", None)
+        if remaining is not None:
+            if isinstance(timeout, (int, float)):
+                # Never wait longer than the client's own bound
+                remaining = min(remaining, timeout)
+            # Retries would run past the deadline, so make a single attempt
+            client = client.with_options(timeout=remaining, max_retries=0)
+
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                deadline.check()
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+        except (DeadlineExceeded, RequestCancelled) as e:
+            e.chunks_received = len(parts)
+            raise
+        finally:
+            stream.close()
+        return "".join(parts), usage
+
+    def _record_abandoned(self, error: Exception, stage: str,
+                          max_tokens: Optional[int] = None):
+        """Count upstream work given up on because its caller stopped waiting."""
+        reason = "cancelled" if isinstance(error, RequestCancelled) else "deadline"
+        metrics.increment("upstream_abandoned", endpoint=self.endpoint,
+                          reason=reason, stage=stage)
+        if max_tokens is not None:
+            # Each streamed chunk carries about one token; the rest of the
+            # token cap is an upper bound on what closing the stream saved
+            unused = max(0, max_tokens - getattr(error, "chunks_received", 0))
+            metrics.increment("upstream_tokens_saved_max", unused,
+                              endpoint=self.endpoint)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the live profile of every candidate model."""
+        return {
+            "in_flight": self.in_flight,
+            "circuit": self.breaker.snapshot(),
+            "models": {p.name: p.snapshot() for p in self.profiles},
+        }
@@ -0,0 +1,427 @@
+"""
+Request Pipeline - Transport-agnostic request handling shared by both server stacks
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import ResultCache
+from .circuit_breaker import CircuitOpenError
+from .deadline import Deadline, DeadlineExceeded, RequestCancelled
+from .metrics import metrics
+from .shared_cache import get_shared_cache
+
+
+PUBLIC_ENDPOINTS = ['/', '/health', '/docs']
+
+
+class PipelineResponse:
+    """Status code, JSON-serialisable payload and extra headers produced by the pipeline."""
+
+    def __init__(self, status_code: int, payload: Dict[str, Any],
+                 headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+
+    @property
+    def ok(self) -> bool:
+        """Return True for successful (2xx/3xx) responses."""
+        return self.status_code < 400
+
+
+class RequestPipeline:
+    """
+    Runs an assessment request through auth, parsing, cache, service call
+    and error classification.
+
+    The pipeline knows nothing about HTTP servers: callers pass in the path,
+    a case-insensitive header mapping and the request body, and render the
+    returned PipelineResponse however their transport requires.
+    """
+
+    def __init__(self, config, risk_service, sea_level_service,
+                 cache: Optional[ResultCache] = None, store=None):
+        """
+        Initialize the RequestPipeline.
+
+        Args:
+            config: Configuration object containing API keys and settings
+            risk_service: Service used for /analyze
+            sea_level_service: Service used for /sea-level
+            cache: Optional result cache, created from config when omitted
+            store: Optional AssessmentStore that scored, geocoded
+                assessments are recorded in; without one, locations are
+                not geocoded
+        """
+        self.config = config
+        self.store = store
+        self.cache = cache if cache is not None else ResultCache(
+            ttl_seconds=config.get_cache_ttl_seconds(),
+            max_entries=config.get_cache_max_entries(),
+            stale_while_revalidate=config.get_cache_stale_while_revalidate(),
+            stale_if_error=config.get_cache_stale_if_error(),
+            shared=get_shared_cache(config),
+            namespace="responses"
+        )
+
+        # path -> (service, result field, error label, cache whole responses)
+        # /analyze is not cached here: LocationRiskService caches per hazard.
+        self.routes = {
+            '/analyze': (risk_service, 'risk_assessment', 'location', False),
+            '/sea-level': (sea_level_service, 'sea_level_assessment', 'sea level', True),
+        }
+
+    @staticmethod
+    def is_public_endpoint(path: str) -> bool:
+        """Check if the endpoint is public (no auth required)."""
+        return path in PUBLIC_ENDPOINTS
+
+    def authenticate(self, headers) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Validate API key and vendor ID from request headers.
+
+        Args:
+            headers: Case-insensitive header mapping
+
+        Returns:
+            (True, credentials) on success, (False, error payload) otherwise
+        """
+        api_key = headers.get('X-API-Key')
+        vendor_id = headers.get('X-Vendor-ID')
+
+        if not api_key:
+            return False, {"error": "Missing X-API-Key header", "code": "MISSING_API_KEY"}
+
+        if not vendor_id:
+            return False, {"error": "Missing X-Vendor-ID header", "code": "MISSING_VENDOR_ID"}
+
+        if not self.config.validate_credentials(api_key, vendor_id):
+            # Determine which credential is invalid for better error messaging
+            if api_key != self.config.get_api_key():
+                return False, {"error": "Invalid API key", "code": "INVALID_API_KEY"}
+            else:
+                return False, {"error": "Invalid vendor ID", "code": "INVALID_VENDOR_ID"}
+
+        return True, {"vendor_id": vendor_id, "api_key": api_key}
+
+    @staticmethod
+    def parse_body(body) -> Dict[str, Any]:
+        """
+        Parse a request body into a dictionary.
+
+        Args:
+            body: Raw bytes/str from the transport, or an already parsed dict
+
+        Returns:
+            The parsed body
+
+        Raises:
+            ValueError: If the body is not a valid JSON object
+        """
+        if isinstance(body, dict):
+            return body
+        if not body:
+            return {}
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+
+        try:
+            body_data = json.loads(body)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON in request body")
+
+        if not isinstance(body_data, dict):
+            raise ValueError("Invalid JSON in request body")
+        return body_data
+
+    @staticmethod
+    def parse_latency_budget(headers) -> Optional[float]:
+        """
+        Read the caller's latency budget from the X-Latency-Budget-Ms header.
+
+        Args:
+            headers: Case-insensitive header mapping
+
+        Returns:
+            Budget in seconds, or None if the header is absent
+
+        Raises:
+            ValueError: If the header is not a positive number
+        """
+        value = headers.get('X-Latency-Budget-Ms')
+        if value is None or value == '':
+            return None
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            budget_ms = 0
+        if budget_ms <= 0:
+            raise ValueError("X-Latency-Budget-Ms must be a positive number")
+        return budget_ms / 1000
+
+    @staticmethod
+    def parse_deadline(headers) -> Optional[float]:
+        """
+        Read how long the caller will wait from the X-Request-Deadline-Ms header.
+
+        Unlike the latency budget, which only steers model selection, the
+        deadline is enforced: upstream calls still running when it passes are
+        abandoned and the request fails with 504.
+
+        Args:
+            headers: Case-insensitive header mapping
+
+        Returns:
+            Deadline in seconds from now, or None if the header is absent
+
+        Raises:
+            ValueError: If the header is not a positive number
+        """
+        value = headers.get('X-Request-Deadline-Ms')
+        if value is None or value == '':
+            return None
+        try:
+            deadline_ms = float(value)
+        except ValueError:
+            deadline_ms = 0
+        if deadline_ms <= 0:
+            raise ValueError("X-Request-Deadline-Ms must be a positive number")
+        return deadline_ms / 1000
+
+    @staticmethod
+    def classify_error(error: Exception, label: str = 'location') -> Tuple[int, str]:
+        """
+        Map an upstream exception to an HTTP status code and client message.
+
+        Args:
+            error: Exception raised by a service
+            label: What was being analyzed, used in the generic message
+
+        Returns:
+            (status code, error detail)
+        """
+        if isinstance(error, CircuitOpenError):
+            return 503, "OpenAI is temporarily unavailable. Please try again later."
+        if isinstance(error, DeadlineExceeded):
+            return 504, f"Request deadline exceeded while analyzing {label}."
+        if isinstance(error, RequestCancelled):
+            # Client Closed Request; nobody is left to read it
+            return 499, "Request cancelled by the client."
+
+        error_message = str(error)
+        if "401" in error_message or "invalid_api_key" in error_message:
+            return 500, "OpenAI API configuration error. Please check your API key."
+        elif "429" in error_message:
+            return 429, "Rate limit exceeded. Please try again later."
+        else:
+            return 500, f"Error analyzing {label}: {error_message}"
+
+    @staticmethod
+    def get_timestamp() -> str:
+        """Get current timestamp in ISO format."""
+        return datetime.utcnow().isoformat() + 'Z'
+
+    def handle(self, path: str, headers, body,
+               deadline: Optional[Deadline] = None) -> PipelineResponse:
+        """
+        Run an assessment request through the pipeline.
+
+        Args:
+            path: Request path, e.g. "/analyze"
+            headers: Case-insensitive header mapping
+            body: Raw request body or already parsed dict
+            deadline: Optional Deadline the transport cancels when the client
+                disconnects; the X-Request-Deadline-Ms header shortens it,
+                counting from the Deadline's start
+
+        Returns:
+            PipelineResponse with the status code and JSON payload
+        """
+        is_valid, auth_result = self.authenticate(headers)
+        if not is_valid:
+            return PipelineResponse(401, auth_result)
+        vendor_id = auth_result.get('vendor_id')
+
+        route = self.routes.get(path)
+        if route is None:
+            return PipelineResponse(404, {"error": "Route not found"})
+        service, field, label, cache_results = route
+
+        try:
+            body_data = self.parse_body(body)
+        except ValueError as e:
+            return PipelineResponse(400, {"error": str(e)})
+
+        location = str(body_data.get('location') or '').strip()
+        if not location:
+            return PipelineResponse(400, {"error": "Location cannot be empty"})
+
+        try:
+            latency_budget = self.parse_latency_budget(headers)
+            timeout = self.parse_deadline(headers)
+            options = self.parse_options(path, body_data)
+        except ValueError as e:
+            return PipelineResponse(400, {"error": str(e)})
+
+        if timeout is not None:
+            if deadline is None:
+                deadline = Deadline(timeout)
+            else:
+                deadline.shorten(timeout)
+
+        return self.assess(path, location, latency_budget, options, vendor_id,
+                           deadline)
+
+    def parse_options(self, path: str, body_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extract endpoint-specific service options from a request body.
+
+        Args:
+            path: Assessment route, e.g. "/analyze"
+            body_data: Parsed request body
+
+        Returns:
+            Keyword arguments for the route's service
+
+        Raises:
+            ValueError: If an option is invalid or unsupported by the route
+        """
+        service = self.routes[path][0]
+        options = {}
+        if body_data.get('hazards') is not None:
+            if not hasattr(service, 'parse_hazards'):
+                raise ValueError(f"hazards is not supported by {path}")
+            options['hazards'] = service.parse_hazards(body_data['hazards'])
+        if body_data.get('latitude') is not None or body_data.get('longitude') is not None:
+            if not hasattr(service, 'geocoder'):
+                raise ValueError(f"latitude/longitude are not supported by {path}")
+            try:
+                latitude = float(body_data['latitude'])
+                longitude = float(body_data['longitude'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("latitude and longitude must both be numbers")
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError("latitude/longitude out of range")
+            options['coordinates'] = (latitude, longitude)
+        return options
+
+    def assess(self, path: str, location: str,
+               latency_budget: Optional[float] = None,
+               options: Optional[Dict[str, Any]] = None,
+               vendor_id: Optional[str] = None,
+               deadline: Optional[Deadline] = None) -> PipelineResponse:
+        """
+        Run the cache and service call for an already validated request.
+
+        Args:
+            path: Assessment route, e.g. "/analyze"
+            location: Non-empty, stripped location string
+            latency_budget: Seconds the caller can wait, or None for no limit
+            options: Keyword arguments from parse_options
+            vendor_id: Authenticated vendor, echoed in the payload
+            deadline: Optional Deadline bounding the upstream calls
+
+        Returns:
+            PipelineResponse with the status code and JSON payload
+        """
+        service, field, label, cache_results = self.routes[path]
+        options = options or {}
+        if (self.store is None and hasattr(service, 'geocoder')
+                and 'coordinates' not in options):
+            # Coordinates are only worth a completion when they get indexed
+            options = dict(options, geocode=False)
+
+        def load(deadline=None):
+            return self._summarize(service.analyze(
+                location, latency_budget=latency_budget, deadline=deadline,
+                **options))
+
+        try:
+            if cache_results:
+                result, stale = self.cache.fetch(
+                    (path, location.casefold()),
+                    lambda: load(deadline), refresh_loader=load)
+            else:
+                result, stale = load(deadline), False
+        except Exception as e:
+            if isinstance(e, (DeadlineExceeded, RequestCancelled)):
+                metrics.increment(
+                    "requests_abandoned", path=path,
+                    reason="cancelled" if isinstance(e, RequestCancelled) else "deadline")
+            status_code, error_detail = self.classify_error(e, label)
+            response_headers = {}
+            if isinstance(e, CircuitOpenError):
+                response_headers['Retry-After'] = str(
+                    max(1, int(e.retry_after + 0.5)))
+            return PipelineResponse(status_code, {
+                "location": location,
+                field: None,
+                "success": False,
+                "error": error_detail,
+                "vendor_id": vendor_id,
+                "timestamp": self.get_timestamp()
+            }, response_headers)
+
+        stale = stale or result["stale"]
+        if (self.store is not None and result["hazards"] is not None
+                and result["latitude"] is not None):
+            self.store.upsert(
+                location, result["latitude"], result["longitude"],
+                {name: hazard["score"]
+                 for name, hazard in result["hazards"].items()})
+        metrics.increment("responses", path=path, model=result["model"],
+                          stale=stale)
+        payload = {
+            "location": location,
+            field: result["assessment"],
+            "model": result["model"],
+            "stale": stale,
+            "success": True,
+            "error": None,
+            "vendor_id": vendor_id,
+            "timestamp": self.get_timestamp()
+        }
+        if result["hazards"] is not None:
+            payload["hazards"] = result["hazards"]
+        if result["latitude"] is not None:
+            payload["latitude"] = result["latitude"]
+            payload["longitude"] = result["longitude"]
+        return PipelineResponse(200, payload)
+
+    @staticmethod
+    def _summarize(completion) -> Dict[str, Any]:
+        """Reduce a service result to the cacheable fields of a response."""
+        hazards = None
+        if hasattr(completion, 'hazards'):
+            stale_hazards = getattr(completion, 'stale_hazards', set())
+            hazards = {
+                name: {
+                    "assessment": result.content,
+                    "model": result.model,
+                    "score": getattr(result, 'score', None),
+                    "stale": name in stale_hazards
+                }
+                for name, result in completion.hazards.items()
+            }
+        coordinates = getattr(completion, 'coordinates', None) or (None, None)
+        return {
+            "assessment": completion.content,
+            "model": completion.model,
+            "hazards": hazards,
+            "latitude": coordinates[0],
+            "longitude": coordinates[1],
+            "stale": getattr(completion, 'stale', False)
+        }
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Return counters and the live model profiles of every route."""
+        return {
+            "counters": metrics.snapshot(),
+            "routers": {
+                path: service.router.snapshot()
+                for path, (service, _, _, _) in self.routes.items()
+                if hasattr(service, 'router')
+            },
+            "cache_entries": len(self.cache),
+        }
@@ -0,0 +1,588 @@
+"""
+Portfolio Scoring - Score large address lists once per spatial cluster
+"""
+import math
+import re
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .deadline import Deadline
+from .jobs import GEOCODE_ENDPOINT
+from .metrics import metrics
+from .spatial_index import RISK_BANDS
+
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+# Unit, apartment and suite designators; properties that differ only by one
+# are the same building and are geocoded and assessed once
+UNIT_DESIGNATOR = re.compile(
+    r"\b(?:apt|apartment|unit|suite|ste|flat|room|rm)\b\.?\s*(?:no\.?\s*)?#?\s*[\w-]+"
+    r"|#\s*[\w-]+"
+)
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_address(location: str) -> str:
+    """
+    Reduce an address to the form used to deduplicate it.
+
+    Case, punctuation, repeated whitespace and unit designators
+    ("Apt 4B", "Suite 200", "#12") are ignored.
+    """
+    text = UNIT_DESIGNATOR.sub(" ", location.casefold())
+    return " ".join(NON_WORD.sub(" ", text).split())
+
+
+def cluster_key(latitude: float, longitude: float,
+                cluster_meters: float) -> Tuple[int, int]:
+    """
+    Snap a coordinate to a roughly cluster_meters-wide grid cell.
+
+    The longitude step is widened by the cell's latitude so cells stay
+    close to square away from the equator.
+    """
+    lat_step = cluster_meters / METERS_PER_DEGREE_LAT
+    lat_index = math.floor(latitude / lat_step)
+    cos_lat = max(math.cos(math.radians((lat_index + 0.5) * lat_step)), 1e-6)
+    lon_index = math.floor(longitude / (lat_step / cos_lat))
+    return lat_index, lon_index
+
+
+def parse_properties(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Validate portfolio input.
+
+    Args:
+        items: Location strings, or dicts with "location" and optional
+            "latitude"/"longitude"
+
+    Returns:
+        List of {"location", "latitude", "longitude"} dicts
+
+    Raises:
+        ValueError: If an item is empty or malformed
+    """
+    properties = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"location": item}
+        if not isinstance(item, dict):
+            raise ValueError(f"Property {index} must be a string or an object")
+
+        location = str(item.get("location") or "").strip()
+        if not location:
+            raise ValueError(f"Property {index} has an empty location")
+
+        latitude, longitude = item.get("latitude"), item.get("longitude")
+        if latitude is not None or longitude is not None:
+            try:
+                latitude, longitude = float(latitude), float(longitude)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    f"Property {index} must give both latitude and longitude as numbers")
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError(f"Property {index} has out-of-range coordinates")
+
+        properties.append({"location": location, "latitude": latitude,
+                           "longitude": longitude})
+    return properties
+
+
+# Lower bounds of the moderate, high and extreme bands, see risk_band
+BAND_THRESHOLDS = (4.0, 7.0, 9.0)
+
+
+def summarize_scores(scores: Sequence[float]) -> Dict[str, Any]:
+    """
+    Distribution statistics for one hazard's per-property score column.
+
+    Args:
+        scores: float32 column (array or ndarray), NaN where the property
+            has no score
+
+    Returns:
+        Count, mean, p50, p90, max, an 11-bucket (0-10) histogram and band counts
+    """
+    values = np.asarray(scores, dtype=np.float32)
+    values = values[~np.isnan(values)]
+    # rint rounds halves to even, as round() did
+    histogram = np.bincount(np.clip(np.rint(values), 0, 10).astype(np.int64),
+                            minlength=11)
+    band_counts = np.bincount(
+        np.searchsorted(BAND_THRESHOLDS, values, side="right"),
+        minlength=len(RISK_BANDS))
+    bands = {band: int(count) for band, count in zip(RISK_BANDS, band_counts)}
+
+    if not values.size:
+        return {"count": 0, "mean": None, "p50": None, "p90": None,
+                "max": None, "histogram": histogram.tolist(), "bands": bands}
+    # The value at index int(fraction * n) of the sorted scores
+    n = values.size
+    p50, p90 = (min(n - 1, int(fraction * n)) for fraction in (0.50, 0.90))
+    ranked = np.partition(values, (p50, p90))
+    return {
+        "count": int(n),
+        "mean": round(float(values.mean(dtype=np.float64)), 3),
+        "p50": float(ranked[p50]),
+        "p90": float(ranked[p90]),
+        "max": float(values.max()),
+        "histogram": histogram.tolist(),
+        "bands": bands,
+    }
+
+
+class PortfolioScorer:
+    """
+    Scores a portfolio by clustering nearby properties and assessing each
+    cluster once through the request pipeline.
+
+    Properties without coordinates are first geocoded once per distinct
+    normalised address (see addresses, geocode and locate), then every
+    located property is clustered by grid cell, so addresses written
+    differently but in the same building share one assessment. Addresses
+    that could not be geocoded are clustered by normalised address and
+    geocoded again as part of their assessment.
+    """
+
+    def __init__(self, pipeline, workers: int = 16,
+                 cluster_meters: float = 100.0):
+        """
+        Initialize the PortfolioScorer.
+
+        Args:
+            pipeline: RequestPipeline used to assess each cluster; its
+                /analyze service's geocoder resolves addresses
+            workers: Concurrent assessment and geocoding calls
+            cluster_meters: Approximate cluster cell width in metres
+        """
+        self.pipeline = pipeline
+        self.geocoder = pipeline.routes['/analyze'][0].geocoder
+        self.cluster_meters = cluster_meters
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="portfolio")
+
+    def score(self, properties: List[Dict[str, Any]],
+              hazards: Optional[List[str]] = None, top_n: int = 10,
+              include_properties: bool = True,
+              vendor_id: Optional[str] = None, deadline: Optional[Deadline] = None,
+              plan: Optional[Tuple[List[Dict[str, Any]], array]] = None) -> Dict[str, Any]:
+        """
+        Score a validated portfolio, waiting for every cluster's assessment.
+
+        Args:
+            properties: Output of parse_properties
+            hazards: Hazard names to assess, or None for all hazards
+            top_n: Number of riskiest clusters to return
+            include_properties: Whether to return per-property results
+            vendor_id: Authenticated vendor, echoed in cluster payloads
+            deadline: Optional Deadline; once it expires or is cancelled,
+                assessments not yet started are skipped
+            plan: Output of plan(properties), if already computed
+
+        Returns:
+            Portfolio summary, aggregates, top clusters and per-property results
+
+        Raises:
+            ValueError: If hazards names an unknown hazard
+            DeadlineExceeded: If the deadline passed before every cluster was assessed
+            RequestCancelled: If the deadline was cancelled
+        """
+        hazard_names = self.pipeline.routes['/analyze'][0].parse_hazards(hazards)
+        clusters, assignments = plan or self.plan(properties)
+
+        # One upstream assessment per cluster
+        outcomes = list(self.executor.map(
+            lambda cluster: self._assess(cluster, hazard_names, vendor_id, deadline),
+            clusters
+        ))
+        if deadline is not None:
+            deadline.check()
+        self._count(properties, clusters)
+        for cluster, outcome in zip(clusters, outcomes):
+            cluster.update(outcome)
+        return self.summarize(properties, clusters, assignments, hazard_names,
+                              top_n, include_properties)
+
+    def submit(self, job_store, properties: List[Dict[str, Any]],
+               hazards: Optional[List[str]] = None, top_n: int = 10,
+               include_properties: bool = True, vendor_id: Optional[str] = None,
+               plan: Optional[Tuple[List[Dict[str, Any]], array]] = None) -> str:
+        """
+        Queue a portfolio as a background job.
+
+        Without a plan, properties lacking coordinates are first geocoded by
+        a GEOCODE_ENDPOINT job, one item per distinct address; once it
+        completes, advance() plans the portfolio and chains the assessment
+        job to it. Otherwise the assessment job is queued straight away:
+        each cluster becomes one /analyze job item, the properties and the
+        clustering are stored with the job, and job_result() builds the
+        portfolio response from the item results once the job completes.
+
+        Args:
+            job_store: JobStore the items are queued in
+            properties: Output of parse_properties (or locate)
+            hazards: Hazard names to assess, or None for all hazards
+            top_n: Number of riskiest clusters to return
+            include_properties: Whether to return per-property results
+            vendor_id: Vendor that owns the job
+            plan: Output of plan(properties), if already computed
+
+        Returns:
+            The job id to poll
+
+        Raises:
+            ValueError: If hazards names an unknown hazard
+        """
+        hazard_names = self.pipeline.routes['/analyze'][0].parse_hazards(hazards)
+        metrics.increment("portfolio_jobs_created")
+        addresses = self.addresses(properties) if plan is None else {}
+        if addresses:
+            metrics.increment("portfolio_geocode_calls", len(addresses))
+            return job_store.create_job(
+                GEOCODE_ENDPOINT, list(addresses.values()), vendor_id=vendor_id,
+                metadata={"portfolio_geocode": {
+                    "properties": properties,
+                    "addresses": list(addresses),
+                    "hazards": hazard_names,
+                    "top_n": top_n,
+                    "include_properties": include_properties,
+                }}
+            )
+
+        return job_store.create_job(vendor_id=vendor_id, **self._assessment_job(
+            properties, hazard_names, top_n, include_properties,
+            plan or self.plan(properties)))
+
+    def advance(self, job_store, job_id: str) -> Optional[str]:
+        """
+        Queue the assessment job of a portfolio whose geocoding job completed.
+
+        Safe to call more than once: the assessment job is only created by
+        the first call.
+
+        Args:
+            job_store: JobStore the jobs are queued in
+            job_id: Id of the geocoding job returned by submit()
+
+        Returns:
+            The assessment job id, or None if job_id is not a portfolio's
+            geocoding job
+        """
+        stage = (job_store.get_metadata(job_id) or {}).get("portfolio_geocode")
+        if stage is None:
+            return None
+        job = job_store.get_job(job_id, 0, 0)
+        if job["next_job_id"] is not None:
+            return job["next_job_id"]
+
+        geocoded = {
+            key: item["result"]["coordinates"] if item["result"] else None
+            for key, item in zip(stage["addresses"], job_store.get_results(job_id))
+        }
+        properties = self.locate(stage["properties"], geocoded)
+        return job_store.chain_job(
+            job_id, vendor_id=job["vendor_id"], **self._assessment_job(
+                properties, stage["hazards"], stage["top_n"],
+                stage["include_properties"], self.plan(properties)))
+
+    def _assessment_job(self, properties: List[Dict[str, Any]],
+                        hazard_names: List[str], top_n: int,
+                        include_properties: bool,
+                        plan: Tuple[List[Dict[str, Any]], array]) -> Dict[str, Any]:
+        """create_job arguments assessing each cluster of a planned portfolio."""
+        clusters, assignments = plan
+        self._count(properties, clusters)
+        return {
+            "endpoint": '/analyze',
+            "locations": [cluster["location"] for cluster in clusters],
+            "options": {"hazards": hazard_names},
+            "item_options": [
+                {"coordinates": [cluster["latitude"], cluster["longitude"]]}
+                if cluster["latitude"] is not None else None
+                for cluster in clusters
+            ],
+            "metadata": {"portfolio": {
+                "properties": properties,
+                "clusters": clusters,
+                "assignments": assignments.tolist(),
+                "hazards": hazard_names,
+                "top_n": top_n,
+                "include_properties": include_properties,
+            }},
+        }
+
+    def job_result(self, job_store, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Build the response of a portfolio job from its item results.
+
+        Args:
+            job_store: JobStore the job was queued in
+            job_id: Id returned by submit()
+
+        Returns:
+            Portfolio response as returned by score(), or None if the job
+            is not a portfolio job
+        """
+        portfolio = (job_store.get_metadata(job_id) or {}).get("portfolio")
+        if portfolio is None:
+            return None
+
+        clusters = portfolio["clusters"]
+        for cluster, item in zip(clusters, job_store.get_results(job_id)):
+            error = item["error"] or (
+                None if item["status"] == "done" else "Assessment not finished")
+            cluster.update(self.outcome(cluster, item["result"], error))
+        return self.summarize(
+            portfolio["properties"], clusters, portfolio["assignments"],
+            portfolio["hazards"], portfolio["top_n"],
+            portfolio["include_properties"])
+
+    @staticmethod
+    def addresses(properties: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Distinct addresses of the properties without coordinates.
+
+        Args:
+            properties: Output of parse_properties
+
+        Returns:
+            Normalised address -> the first location string seen for it
+        """
+        found = {}
+        for prop in properties:
+            if prop["latitude"] is None:
+                key = normalize_address(prop["location"])
+                found.setdefault(key, prop["location"])
+        return found
+
+    def geocode(self, addresses: Dict[str, str],
+                deadline: Optional[Deadline] = None
+                ) -> Dict[str, Optional[Tuple[float, float]]]:
+        """
+        Geocode addresses concurrently, each answer cached by the geocoder.
+
+        Args:
+            addresses: Output of addresses()
+            deadline: Optional Deadline bounding the geocoding calls
+
+        Returns:
+            Normalised address -> (latitude, longitude), or None if it
+            could not be resolved
+
+        Raises:
+            DeadlineExceeded: If the deadline passed while geocoding
+            RequestCancelled: If the deadline was cancelled
+        """
+        keys = list(addresses)
+        coordinates = list(self.executor.map(
+            lambda key: self.geocoder.geocode(addresses[key], deadline), keys))
+        if deadline is not None:
+            deadline.check()
+        metrics.increment("portfolio_geocode_calls", len(keys))
+        return dict(zip(keys, coordinates))
+
+    @staticmethod
+    def locate(properties: List[Dict[str, Any]],
+               geocoded: Dict[str, Optional[Sequence[float]]]) -> List[Dict[str, Any]]:
+        """
+        Give properties without coordinates those geocoded for their address.
+
+        Args:
+            properties: Output of parse_properties
+            geocoded: Output of geocode()
+
+        Returns:
+            The properties, copied where coordinates were filled in
+        """
+        located = []
+        for prop in properties:
+            if prop["latitude"] is None:
+                coordinates = geocoded.get(normalize_address(prop["location"]))
+                if coordinates is not None:
+                    prop = dict(prop, latitude=coordinates[0],
+                                longitude=coordinates[1])
+            located.append(prop)
+        return located
+
+    def plan(self, properties: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], array]:
+        """
+        Assign every property to a cluster, without any upstream call.
+
+        Args:
+            properties: Output of parse_properties or locate
+
+        Returns:
+            (clusters, assignments): the clusters, each with a representative
+            location and the mean coordinates of its members (None when it
+            still has to be geocoded), and each property's cluster index
+        """
+        clusters = []
+        keys = {}
+        assignments = array('l')
+        for prop in properties:
+            latitude, longitude = prop["latitude"], prop["longitude"]
+            if latitude is None:
+                key = ("address", normalize_address(prop["location"]))
+            else:
+                key = ("cell",) + cluster_key(latitude, longitude,
+                                              self.cluster_meters)
+
+            index = keys.get(key)
+            if index is None:
+                index = keys[key] = len(clusters)
+                clusters.append({
+                    "cluster_id": index,
+                    "location": prop["location"],
+                    "members": 0,
+                    "lat_sum": 0.0,
+                    "lon_sum": 0.0,
+                    "located": 0,
+                })
+            cluster = clusters[index]
+            cluster["members"] += 1
+            if latitude is not None:
+                cluster["lat_sum"] += latitude
+                cluster["lon_sum"] += longitude
+                cluster["located"] += 1
+            assignments.append(index)
+
+        for cluster in clusters:
+            located = cluster.pop("located")
+            lat_sum, lon_sum = cluster.pop("lat_sum"), cluster.pop("lon_sum")
+            if located:
+                cluster["latitude"] = lat_sum / located
+                cluster["longitude"] = lon_sum / located
+            else:
+                cluster["latitude"] = cluster["longitude"] = None
+        return clusters, assignments
+
+    def summarize(self, properties: List[Dict[str, Any]],
+                  clusters: List[Dict[str, Any]], assignments: Sequence[int],
+                  hazard_names: List[str], top_n: int = 10,
+                  include_properties: bool = True) -> Dict[str, Any]:
+        """
+        Build the portfolio response from assessed clusters.
+
+        Args:
+            properties: Output of parse_properties
+            clusters: Clusters from plan(), each with "scores" and "error"
+            assignments: Each property's cluster index, from plan()
+            hazard_names: Hazards that were assessed
+            top_n: Number of riskiest clusters to return
+            include_properties: Whether to return per-property results
+
+        Returns:
+            Portfolio summary, aggregates, top clusters and per-property results
+        """
+        # Per-property score columns for the aggregates, gathered from one
+        # score per cluster
+        cluster_of = np.asarray(assignments, dtype=np.int64)
+        columns = {}
+        for name in hazard_names:
+            scores = [(c["scores"] or {}).get(name) for c in clusters]
+            columns[name] = np.array(
+                [math.nan if score is None else score for score in scores],
+                dtype=np.float32)[cluster_of]
+        # Properties given coordinates always land in a located cluster
+        ungeocoded = sum(c["members"] for c in clusters if c["latitude"] is None)
+
+        results = []
+        if include_properties:
+            for index, (prop, cluster_index) in enumerate(zip(properties, assignments)):
+                cluster = clusters[cluster_index]
+                latitude, longitude = prop["latitude"], prop["longitude"]
+                if latitude is None:
+                    latitude, longitude = cluster["latitude"], cluster["longitude"]
+                results.append({
+                    "index": index,
+                    "location": prop["location"],
+                    "cluster_id": cluster["cluster_id"],
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "scores": cluster["scores"],
+                    "status": "error" if cluster["error"] else "done",
+                    "error": cluster["error"],
+                })
+
+        response = {
+            "total_properties": len(properties),
+            "clusters": len(clusters),
+            "ungeocoded_properties": ungeocoded,
+            "failed_clusters": sum(1 for c in clusters if c["error"]),
+            "aggregates": {name: summarize_scores(column)
+                           for name, column in columns.items()},
+            "top_clusters": self._top_clusters(clusters, top_n),
+        }
+        if include_properties:
+            response["properties"] = results
+        return response
+
+    @staticmethod
+    def _count(properties: List[Dict[str, Any]], clusters: List[Dict[str, Any]]):
+        metrics.increment("portfolio_properties", len(properties))
+        metrics.increment("portfolio_clusters_assessed", len(clusters))
+        # Clusters without coordinates are geocoded by their assessment
+        metrics.increment("portfolio_geocode_calls",
+                          sum(1 for c in clusters if c["latitude"] is None))
+
+    def _assess(self, cluster: Dict[str, Any], hazards: List[str],
+                vendor_id: Optional[str],
+                deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Assess a cluster's representative location."""
+        options = {"hazards": hazards}
+        if cluster["latitude"] is not None:
+            options["coordinates"] = (cluster["latitude"], cluster["longitude"])
+
+        result = self.pipeline.assess(
+            '/analyze', cluster["location"], options=options,
+            vendor_id=vendor_id, deadline=deadline)
+        return self.outcome(cluster, result.payload if result.ok else None,
+                            result.payload.get("error"))
+
+    @staticmethod
+    def outcome(cluster: Dict[str, Any], payload: Optional[Dict[str, Any]],
+                error: Optional[str]) -> Dict[str, Any]:
+        """
+        Scores, error and coordinates of a cluster from its /analyze payload.
+
+        A cluster assessed without coordinates takes those its assessment
+        geocoded.
+        """
+        if payload is None:
+            return {"scores": None, "error": error or "Assessment failed"}
+        outcome = {
+            "scores": {name: hazard["score"]
+                       for name, hazard in payload["hazards"].items()},
+            "error": None,
+        }
+        if cluster["latitude"] is None and payload.get("latitude") is not None:
+            outcome["latitude"] = payload["latitude"]
+            outcome["longitude"] = payload["longitude"]
+        return outcome
+
+    @staticmethod
+    def _top_clusters(clusters: List[Dict[str, Any]], top_n: int) -> List[Dict[str, Any]]:
+        """Riskiest clusters by highest hazard score, then mean score, then size."""
+        def rank(cluster):
+            scores = [s for s in (cluster["scores"] or {}).values() if s is not None]
+            if not scores:
+                return (-1, -1, 0)
+            return (max(scores), sum(scores) / len(scores), cluster["members"])
+
+        ranked = sorted((c for c in clusters if c["scores"]), key=rank, reverse=True)
+        return [
+            {
+                "cluster_id": c["cluster_id"],
+                "location": c["location"],
+                "latitude": c["latitude"],
+                "longitude": c["longitude"],
+                "members": c["members"],
+                "max_score": rank(c)[0],
+                "scores": c["scores"],
+            }
+            for c in ranked[:top_n]
+        ]
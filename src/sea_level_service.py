@@ -1,5 +1,11 @@
+from typing import Optional
+
 from openai import OpenAI
 
+from .circuit_breaker import CircuitBreaker
+from .deadline import Deadline
+from .model_router import ModelRouter, RoutedCompletion
+
 
 class SeaLevelService:
     """Service class for analyzing sea level risks using OpenAI API."""
@@ -12,7 +18,18 @@ class SeaLevelService:
             config: Configuration object containing API keys and settings
         """
         self.config = config
-        self.client = OpenAI(api_key=config.get_openai_api_key())
+        self.client = OpenAI(api_key=config.get_openai_api_key(),
+                             **config.get_openai_client_settings())
+
+        settings = config.get_model_settings("sea-level")
+        self.router = ModelRouter(
+            "sea-level",
+            settings["models"],
+            temperature=settings["temperature"],
+            max_tokens=settings["max_tokens"],
+            load_threshold=config.get_router_load_threshold("sea-level"),
+            breaker=CircuitBreaker("sea-level", **config.get_breaker_settings())
+        )
 
     def analyze_location_risk(self, location: str) -> str:
         """
@@ -23,33 +40,48 @@ class SeaLevelService:
 
         Returns:
             A string containing the risk assessment
+
+        Raises:
+            openai.OpenAIError: If the upstream completion request fails
+        """
+        return self.analyze(location).content
+
+    def analyze(self, location: str,
+                latency_budget: Optional[float] = None,
+                deadline: Optional[Deadline] = None) -> RoutedCompletion:
+        """
+        Analyze a location on the model chosen by the router.
+
+        Args:
+            location: The location to analyze (e.g., "San Francisco, CA")
+            latency_budget: Seconds the caller can wait, or None for no limit
+            deadline: Optional Deadline bounding the upstream call
+
+        Returns:
+            RoutedCompletion with the assessment text and the model used
+
+        Raises:
+            openai.OpenAIError: If the upstream completion request fails
+        """
+        prompt = f"""
+        Calculate the distance from sea level for the following location: {location}
+        
+        Please provide a response that includes ALL of the following 4 points:
+        
+        1. Distance to water (provide brief assessment with context)
+        2. Distance to sea level (provide brief assessment with context)
+        3. Distance to sea level: [X] m (only the numerical distance)
+        4. Distance to water: [X] m (only the numerical distance)
+
+        Keep the response concise and informative. Return the distance in metres as a number only with no additional assessment.
         """
-        try:
-            prompt = f"""
-            Calculate the distance from sea level for the following location: {location}
-            
-            Please provide a response that includes ALL of the following 4 points:
-            
-            1. Distance to water (provide brief assessment with context)
-            2. Distance to sea level (provide brief assessment with context)
-            3. Distance to sea level: [X] m (only the numerical distance)
-            4. Distance to water: [X] m (only the numerical distance)
-
-            Keep the response concise and informative. Return the distance in metres as a number only with no additional assessment.
-            """
-
-            response = self.client.chat.completions.create(
-                # model="gpt-4.1-2025-04-14",
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that provides location risk assessments."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=500
-            )
-
-            return response.choices[0].message.content
-
-        except Exception as e:
-            return f"Error analyzing location: {str(e)}"
+
+        return self.router.complete(
+            self.client,
+            [
+                {"role": "system", "content": "You are a helpful assistant that provides location risk assessments."},
+                {"role": "user", "content": prompt}
+            ],
+            latency_budget=latency_budget,
+            deadline=deadline
+        )
@@ -0,0 +1,227 @@
+"""
+Shared Cache - Memory-mapped result cache segment shared by all server workers
+"""
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Any, Hashable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock on Windows; one process only
+    fcntl = None
+
+from .metrics import metrics
+
+
+MAGIC = b"LRSC"
+VERSION = 2
+# magic, version, slots, slot_bytes; padded to HEADER_BYTES
+HEADER = struct.Struct("<4sIII")
+HEADER_BYTES = 64
+# seq, key length, key hash, expires_at (time.time()), value length
+SLOT_HEADER = struct.Struct("<IH2xQdI4x")
+SEQ = struct.Struct("<I")
+
+
+class SharedMemoryCache:
+    """
+    Fixed-size, direct-mapped key/value store in a memory-mapped file.
+
+    Every worker process maps the same file, so a value computed by one
+    worker is visible to all of them. The file is split into ``slots`` slots
+    of ``slot_bytes`` each and a key always lands in the slot picked by its
+    hash, replacing whatever was there. Values are stored as JSON - never
+    pickled, so whoever can write the segment still cannot make the workers
+    run code - and read without a lock.
+
+    The file and its directory must belong to the current user and be closed
+    to everyone else; the segment refuses to open otherwise.
+
+    Writers serialise on a thread lock plus an flock on the file. Each slot
+    carries a sequence number that is odd while the slot is being written and
+    bumped on every write (a seqlock), so a reader that sees it change treats
+    the read as a miss.
+    """
+
+    def __init__(self, path: str, slots: int = 4096, slot_bytes: int = 8192):
+        """
+        Open, or create, the segment at path.
+
+        A file whose layout does not match slots/slot_bytes is reset.
+
+        Args:
+            path: Backing file, ideally in a private directory on a tmpfs
+                such as /dev/shm
+            slots: Number of slots
+            slot_bytes: Size of each slot, including its key and header
+
+        Raises:
+            PermissionError: If the file or its directory is not private to
+                the current user, or the path is a symlink
+        """
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.size = HEADER_BYTES + slots * slot_bytes
+        self._lock = threading.Lock()
+        self._check_directory()
+        self._fd = os.open(
+            path,
+            os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+            | getattr(os, "O_CLOEXEC", 0),
+            0o600
+        )
+        try:
+            self._check_file()
+        except PermissionError:
+            os.close(self._fd)
+            raise
+
+        header = (MAGIC, VERSION, slots, slot_bytes)
+        with self._write_lock():
+            current = os.pread(self._fd, HEADER.size, 0)
+            if (len(current) < HEADER.size or HEADER.unpack(current) != header
+                    or os.fstat(self._fd).st_size != self.size):
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, HEADER.pack(*header), 0)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def _check_directory(self):
+        """Refuse a directory in which another user could create or replace the file."""
+        if not hasattr(os, "geteuid"):  # pragma: no cover - no owners on Windows
+            return
+        parent = os.stat(os.path.dirname(os.path.abspath(self.path)))
+        if parent.st_uid != os.geteuid() or parent.st_mode & 0o022:
+            raise PermissionError(
+                f"Shared cache directory of {self.path} must be owned by this "
+                f"user and writable by nobody else")
+
+    def _check_file(self):
+        """Refuse a file another user owns or could read or write."""
+        if not hasattr(os, "geteuid"):  # pragma: no cover - no owners on Windows
+            return
+        info = os.fstat(self._fd)
+        if (not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid()
+                or info.st_mode & 0o077):
+            raise PermissionError(
+                f"Shared cache {self.path} must be a regular file owned by "
+                f"this user and accessible to nobody else (mode 0600)")
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclude writers in this process (thread lock) and in others (flock)."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _locate(self, key: Hashable) -> Tuple[bytes, int, int]:
+        """Return the key's bytes, its 64-bit hash and its slot offset."""
+        key_bytes = repr(key).encode("utf-8")
+        key_hash = int.from_bytes(
+            hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+        return key_bytes, key_hash, HEADER_BYTES + (key_hash % self.slots) * self.slot_bytes
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Look a key up.
+
+        Args:
+            key: Cache key; its repr() identifies it across processes
+
+        Returns:
+            (value, expires_at as a time.time() timestamp), or None on a miss
+        """
+        key_bytes, key_hash, offset = self._locate(key)
+        seq, key_len, slot_hash, expires_at, value_len = SLOT_HEADER.unpack_from(
+            self._map, offset)
+        if seq & 1 or slot_hash != key_hash or not value_len:
+            return None
+
+        start = offset + SLOT_HEADER.size
+        if key_len != len(key_bytes) or self._map[start:start + key_len] != key_bytes:
+            return None
+
+        start += key_len
+        data = self._map[start:start + value_len]
+        if SEQ.unpack_from(self._map, offset)[0] != seq:
+            metrics.increment("shared_cache_torn_reads")
+            return None
+        try:
+            return json.loads(data), expires_at
+        except ValueError:
+            metrics.increment("shared_cache_torn_reads")
+            return None
+
+    def set(self, key: Hashable, value: Any, expires_at: float):
+        """
+        Store a value, replacing whatever occupies the key's slot.
+
+        Values that are not JSON-serialisable or do not fit a slot are skipped.
+
+        Args:
+            key: Cache key; its repr() identifies it across processes
+            value: JSON-serialisable value; tuples are read back as lists
+            expires_at: time.time() timestamp at which the value expires
+        """
+        key_bytes, key_hash, offset = self._locate(key)
+        try:
+            data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            metrics.increment("shared_cache_skipped", reason="unserialisable")
+            return
+        if SLOT_HEADER.size + len(key_bytes) + len(data) > self.slot_bytes:
+            metrics.increment("shared_cache_skipped", reason="oversize")
+            return
+
+        start = offset + SLOT_HEADER.size
+        with self._write_lock():
+            seq = SEQ.unpack_from(self._map, offset)[0]
+            SEQ.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF)
+            self._map[start:start + len(key_bytes)] = key_bytes
+            start += len(key_bytes)
+            self._map[start:start + len(data)] = data
+            # Fill in the header while the slot is still marked as being
+            # written; the even sequence number that publishes it goes last
+            SLOT_HEADER.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF,
+                                  len(key_bytes), key_hash, expires_at, len(data))
+            SEQ.pack_into(self._map, offset, (seq + 2) & 0xFFFFFFFF)
+
+
+_segments = {}
+_segments_lock = threading.Lock()
+
+
+def get_shared_cache(config) -> Optional[SharedMemoryCache]:
+    """
+    Return this process's mapping of the configured segment.
+
+    Args:
+        config: Configuration object containing API keys and settings
+
+    Returns:
+        SharedMemoryCache, or None if SHARED_CACHE_PATH is not set
+    """
+    path = config.get_shared_cache_path()
+    if not path:
+        return None
+    with _segments_lock:
+        segment = _segments.get(path)
+        if segment is None:
+            segment = _segments[path] = SharedMemoryCache(
+                path,
+                slots=config.get_shared_cache_slots(),
+                slot_bytes=config.get_shared_cache_slot_bytes()
+            )
+        return segment
@@ -0,0 +1,541 @@
+"""
+Spatial Index - Columnar, grid-indexed store of per-hazard risk scores
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import metrics
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Band name -> inclusive (min, max) score range on the 0-10 scale
+RISK_BANDS = {
+    "low": (0.0, 3.0),
+    "moderate": (4.0, 6.0),
+    "high": (7.0, 8.0),
+    "extreme": (9.0, 10.0),
+}
+
+
+def risk_band(score: float) -> str:
+    """Return the band a 0-10 score falls in."""
+    if score < 4:
+        return "low"
+    if score < 7:
+        return "moderate"
+    if score < 9:
+        return "high"
+    return "extreme"
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (math.sin(d_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _haversine_km_array(lat: float, lon: float, latitudes: np.ndarray,
+                        longitudes: np.ndarray) -> np.ndarray:
+    """Vectorised haversine_km from one point to arrays of points."""
+    phi1, phi2 = math.radians(lat), np.radians(latitudes)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(longitudes - lon)
+    a = (np.sin(d_phi / 2) ** 2 +
+         math.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialQuery:
+    """Validated area and score filters for a store query."""
+
+    def __init__(self, bbox: Optional[Tuple[float, float, float, float]] = None,
+                 center: Optional[Tuple[float, float]] = None,
+                 radius_km: Optional[float] = None,
+                 filters: Optional[Dict[str, Tuple[float, float]]] = None,
+                 limit: int = 100):
+        self.bbox = bbox
+        self.center = center
+        self.radius_km = radius_km
+        self.filters = filters or {}
+        self.limit = limit
+
+    @classmethod
+    def from_dict(cls, body: Dict[str, Any], hazards: Iterable[str],
+                  max_limit: int = 10000) -> "SpatialQuery":
+        """
+        Build a query from a request body.
+
+        The body gives either ``bbox`` as ``[min_lat, min_lon, max_lat,
+        max_lon]`` or ``center`` as ``[lat, lon]`` with ``radius_km``, plus
+        optional ``filters`` mapping a hazard to ``{"min": x, "max": y}`` or to
+        a band name (``low``, ``moderate``, ``high``, ``extreme``).
+
+        Args:
+            body: Parsed request body
+            hazards: Valid hazard names
+            max_limit: Largest accepted ``limit``
+
+        Returns:
+            SpatialQuery
+
+        Raises:
+            ValueError: If the body is invalid
+        """
+        try:
+            bbox = body.get("bbox")
+            center = body.get("center")
+            radius_km = body.get("radius_km")
+
+            if bbox is not None:
+                if len(bbox) != 4:
+                    raise ValueError(
+                        "bbox must be [min_lat, min_lon, max_lat, max_lon]")
+                min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox)
+                if min_lat > max_lat or min_lon > max_lon:
+                    raise ValueError("bbox minimums must not exceed maximums")
+                bbox = (min_lat, min_lon, max_lat, max_lon)
+            elif center is not None and radius_km is not None:
+                if len(center) != 2:
+                    raise ValueError("center must be [lat, lon]")
+                lat, lon = (float(v) for v in center)
+                center = (lat, lon)
+                radius_km = float(radius_km)
+                if radius_km <= 0:
+                    raise ValueError("radius_km must be positive")
+            else:
+                raise ValueError("Provide either bbox or center with radius_km")
+
+            filters = {}
+            for hazard, condition in (body.get("filters") or {}).items():
+                if hazard not in hazards:
+                    raise ValueError(f"Unknown hazard '{hazard}'")
+                if isinstance(condition, str):
+                    if condition not in RISK_BANDS:
+                        raise ValueError(
+                            f"Unknown band '{condition}'. Valid bands: {', '.join(RISK_BANDS)}")
+                    filters[hazard] = RISK_BANDS[condition]
+                else:
+                    filters[hazard] = (float(condition.get("min", 0)),
+                                       float(condition.get("max", 10)))
+
+            limit = int(body.get("limit", 100))
+            if not 1 <= limit <= max_limit:
+                raise ValueError(f"limit must be between 1 and {max_limit}")
+        except (TypeError, AttributeError):
+            raise ValueError("Malformed spatial query")
+
+        return cls(bbox, center if bbox is None else None,
+                   radius_km if bbox is None else None, filters, limit)
+
+    def bounds(self) -> List[Tuple[float, float, float, float]]:
+        """
+        Bounding boxes enclosing the query area.
+
+        A circle is boxed by the great-circle reach in longitude at its
+        latitude, widened to every longitude when it contains a pole, and
+        split in two where it crosses the antimeridian.
+        """
+        if self.bbox is not None:
+            return [self.bbox]
+        lat, lon = self.center
+        angle = self.radius_km / EARTH_RADIUS_KM
+        d_lat = math.degrees(angle)
+        min_lat, max_lat = lat - d_lat, lat + d_lat
+        if min_lat <= -90.0 or max_lat >= 90.0:
+            return [(max(-90.0, min_lat), -180.0, min(90.0, max_lat), 180.0)]
+
+        d_lon = math.degrees(math.asin(
+            math.sin(angle) / math.cos(math.radians(lat))))
+        min_lon, max_lon = lon - d_lon, lon + d_lon
+        if min_lon < -180.0:
+            return [(min_lat, min_lon + 360.0, max_lat, 180.0),
+                    (min_lat, -180.0, max_lat, max_lon)]
+        if max_lon > 180.0:
+            return [(min_lat, min_lon, max_lat, 180.0),
+                    (min_lat, -180.0, max_lat, max_lon - 360.0)]
+        return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+class AssessmentStore:
+    """
+    In-memory, array-backed store of assessed locations.
+
+    Each attribute is a column (``array.array``) indexed by row id, with one
+    float32 score column per hazard (NaN where a hazard was never assessed).
+    A uniform lat/lon grid maps each cell to the row ids inside it, so area
+    queries only touch rows in the overlapping cells and never call upstream.
+    """
+
+    def __init__(self, hazards: Iterable[str], cell_degrees: float = 0.1):
+        """
+        Initialize the AssessmentStore.
+
+        Args:
+            hazards: Hazard names that get a score column
+            cell_degrees: Grid cell size in degrees
+        """
+        self.hazards = list(hazards)
+        self.cell_degrees = cell_degrees
+        self.locations = []
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.updated_at = array('d')
+        self.scores = {hazard: array('f') for hazard in self.hazards}
+        self._rows = {}
+        self._grid = {}
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.locations)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (math.floor(latitude / self.cell_degrees),
+                math.floor(longitude / self.cell_degrees))
+
+    def upsert(self, location: str, latitude: float, longitude: float,
+               scores: Dict[str, Optional[float]],
+               updated_at: Optional[float] = None):
+        """
+        Insert or update a location's coordinates and hazard scores.
+
+        Hazards missing from scores, or with a None score, keep their
+        previously stored value.
+
+        Args:
+            location: Location string, matched case-insensitively
+            latitude: Latitude in degrees
+            longitude: Longitude in degrees
+            scores: Hazard name -> 0-10 score
+            updated_at: Time of the assessment, defaults to now
+        """
+        key = location.casefold()
+        cell = self._cell(latitude, longitude)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self.locations)
+                self._rows[key] = row
+                self.locations.append(location)
+                self.latitudes.append(latitude)
+                self.longitudes.append(longitude)
+                self.updated_at.append(0.0)
+                for column in self.scores.values():
+                    column.append(math.nan)
+                self._grid.setdefault(cell, array('l')).append(row)
+            else:
+                old_cell = self._cell(self.latitudes[row], self.longitudes[row])
+                if old_cell != cell:
+                    self._grid[old_cell].remove(row)
+                    self._grid.setdefault(cell, array('l')).append(row)
+                self.latitudes[row] = latitude
+                self.longitudes[row] = longitude
+
+            for hazard, score in scores.items():
+                if hazard in self.scores and score is not None:
+                    self.scores[hazard][row] = score
+            self.updated_at[row] = time.time() if updated_at is None else updated_at
+
+    def _candidate_rows(self, boxes: List[Tuple[float, float, float, float]]
+                        ) -> np.ndarray:
+        """Return the row ids in the grid cells overlapping any bounding box."""
+        found = {}
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            min_x, min_y = self._cell(min_lat, min_lon)
+            max_x, max_y = self._cell(max_lat, max_lon)
+
+            # A box covering more cells than there are occupied cells is
+            # cheaper to answer by walking the occupied cells
+            if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self._grid):
+                found.update(((x, y), rows) for (x, y), rows in self._grid.items()
+                             if min_x <= x <= max_x and min_y <= y <= max_y)
+            else:
+                found.update(((x, y), self._grid[(x, y)])
+                             for x in range(min_x, max_x + 1)
+                             for y in range(min_y, max_y + 1)
+                             if (x, y) in self._grid)
+
+        cells = list(found.values())
+        if not cells:
+            return np.empty(0, dtype=np.int64)
+        if sum(len(rows) for rows in cells) * 2 > len(self.locations):
+            # Most of the store: one pass over whole columns beats gathering
+            return np.arange(len(self.locations), dtype=np.int64)
+        # frombuffer views are dropped straight away: while one is alive the
+        # array it exports cannot grow
+        return np.concatenate(
+            [np.frombuffer(rows, dtype=rows.typecode) for rows in cells])
+
+    @staticmethod
+    def _gather(column: array, rows: np.ndarray) -> np.ndarray:
+        """Copy the values of the given rows out of a column."""
+        values = np.frombuffer(column, dtype=column.typecode)
+        if len(rows) == len(values):
+            return values.copy()  # rows is every row, in order
+        return values[rows]
+
+    def query(self, query: SpatialQuery) -> Dict[str, Any]:
+        """
+        Return stored locations matching an area and score filters.
+
+        The candidate rows of the overlapping grid cells are filtered in bulk
+        with numpy, one vectorised pass per condition.
+
+        Args:
+            query: SpatialQuery
+
+        Returns:
+            Dict with the total match count and up to ``limit`` results,
+            in insertion order
+        """
+        boxes = query.bounds()
+
+        with self._lock:
+            rows = self._candidate_rows(boxes)
+            latitudes = self._gather(self.latitudes, rows)
+            longitudes = self._gather(self.longitudes, rows)
+            mask = np.zeros(rows.size, dtype=bool)
+            for min_lat, min_lon, max_lat, max_lon in boxes:
+                mask |= ((latitudes >= min_lat) & (latitudes <= max_lat) &
+                         (longitudes >= min_lon) & (longitudes <= max_lon))
+            if query.center is not None:
+                mask &= _haversine_km_array(
+                    query.center[0], query.center[1],
+                    latitudes, longitudes) <= query.radius_km
+            for hazard, (low, high) in query.filters.items():
+                # NaN (never assessed) fails every comparison, so it never matches
+                scores = self._gather(self.scores[hazard], rows)
+                mask &= (scores >= low) & (scores <= high)
+
+            matched = rows[mask]
+            matched.sort()
+            results = [self._row_dict(int(row)) for row in matched[:query.limit]]
+
+        return {"total": int(matched.size), "returned": len(results),
+                "results": results}
+
+    def _row_dict(self, row: int) -> Dict[str, Any]:
+        scores = {}
+        for hazard, column in self.scores.items():
+            score = column[row]
+            scores[hazard] = None if math.isnan(score) else round(score, 2)
+        return {
+            "location": self.locations[row],
+            "latitude": self.latitudes[row],
+            "longitude": self.longitudes[row],
+            "scores": scores,
+            "updated_at": self.updated_at[row],
+        }
+
+    def save(self, path: str):
+        """
+        Write the store to a directory of raw column files.
+
+        Each file is written to a temporary name and renamed into place, with
+        meta.json last. Rows are only ever appended, so a crash part-way
+        through leaves columns at least as long as the saved meta.json lists
+        locations, and load() still finds a consistent store.
+        """
+        os.makedirs(path, exist_ok=True)
+        # Snapshot under the lock, write outside it so upserts and queries
+        # are not held up by disk I/O
+        with self._lock:
+            columns = {
+                "latitudes": array('d', self.latitudes),
+                "longitudes": array('d', self.longitudes),
+                "updated_at": array('d', self.updated_at),
+            }
+            columns.update({f"score_{h}": array('f', c)
+                            for h, c in self.scores.items()})
+            meta = {"hazards": self.hazards,
+                    "cell_degrees": self.cell_degrees,
+                    "locations": list(self.locations)}
+
+        def write(name, dump):
+            file_path = os.path.join(path, name)
+            tmp_path = f"{file_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                dump(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+
+        with self._save_lock:
+            for name, column in columns.items():
+                write(f"{name}.bin", column.tofile)
+            write("meta.json", lambda f: f.write(json.dumps(meta).encode()))
+
+    @classmethod
+    def load(cls, path: str, hazards: Iterable[str],
+             cell_degrees: float = 0.1) -> "AssessmentStore":
+        """
+        Read a store written by save(), or return an empty one if none exists.
+
+        A column file shorter than meta.json expects (e.g. written by an
+        interrupted save) drops the rows it is missing rather than failing.
+
+        Args:
+            path: Directory passed to save()
+            hazards: Hazard names that get a score column
+            cell_degrees: Grid cell size in degrees
+
+        Returns:
+            AssessmentStore
+        """
+        store = cls(hazards, cell_degrees)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return store
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        count = len(meta["locations"])
+
+        def read(name, typecode):
+            column = array(typecode)
+            file_path = os.path.join(path, f"{name}.bin")
+            if os.path.exists(file_path):
+                with open(file_path, "rb") as f:
+                    data = f.read(count * column.itemsize)
+                # A short file keeps only the items it holds in full
+                column.frombytes(data[:len(data) - len(data) % column.itemsize])
+            else:
+                column.extend([math.nan] * count)
+            return column
+
+        store.locations = meta["locations"]
+        store.latitudes = read("latitudes", 'd')
+        store.longitudes = read("longitudes", 'd')
+        store.updated_at = read("updated_at", 'd')
+        store.scores = {h: read(f"score_{h}", 'f') for h in store.hazards}
+        columns = [store.latitudes, store.longitudes, store.updated_at,
+                   *store.scores.values()]
+        complete = min(len(column) for column in columns)
+        if complete < count:
+            metrics.increment("spatial_store_rows_dropped", count - complete)
+            del store.locations[complete:]
+            for column in columns:
+                del column[complete:]
+        for row, location in enumerate(store.locations):
+            store._rows[location.casefold()] = row
+            cell = store._cell(store.latitudes[row], store.longitudes[row])
+            store._grid.setdefault(cell, array('l')).append(row)
+        return store
+
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assessments (
+    key TEXT PRIMARY KEY,
+    location TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    scores TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assessments_version ON assessments (version);
+"""
+
+
+class SharedAssessmentStore(AssessmentStore):
+    """
+    AssessmentStore whose upserts are shared through a SQLite database.
+
+    Several processes can use the same database. Each upsert is written to
+    the database with a new version number, and every process applies the
+    rows with a version newer than the last one it saw before answering a
+    query. The database is the durable copy, so nothing needs saving.
+    """
+
+    def __init__(self, path: str, hazards: Iterable[str],
+                 cell_degrees: float = 0.1):
+        """
+        Initialize the SharedAssessmentStore and create its table if needed.
+
+        Args:
+            path: SQLite database file shared by every process
+            hazards: Hazard names that get a score column
+            cell_degrees: Grid cell size in degrees
+        """
+        super().__init__(hazards, cell_degrees)
+        self.path = path
+        self._version = 0
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SHARED_SCHEMA)
+        finally:
+            conn.close()
+        self.sync()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def upsert(self, location: str, latitude: float, longitude: float,
+               scores: Dict[str, Optional[float]],
+               updated_at: Optional[float] = None):
+        """Record an upsert in the database, then apply it and any others."""
+        key = location.casefold()
+        updated_at = time.time() if updated_at is None else updated_at
+        conn = self._connect()
+        try:
+            # The write lock serialises versions, so rows commit in version
+            # order and a reader never skips one that commits later
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT scores FROM assessments WHERE key = ?",
+                    (key,)).fetchone()
+                merged = json.loads(row[0]) if row else {}
+                merged.update({hazard: score for hazard, score in scores.items()
+                               if score is not None})
+                conn.execute(
+                    "INSERT INTO assessments VALUES (?, ?, ?, ?, ?, ?, "
+                    "(SELECT COALESCE(MAX(version), 0) + 1 FROM assessments)) "
+                    "ON CONFLICT (key) DO UPDATE SET location = excluded.location, "
+                    "latitude = excluded.latitude, longitude = excluded.longitude, "
+                    "scores = excluded.scores, updated_at = excluded.updated_at, "
+                    "version = excluded.version",
+                    (key, location, latitude, longitude, json.dumps(merged),
+                     updated_at))
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.sync()
+
+    def sync(self):
+        """Apply the rows other processes (and this one) wrote since the last sync."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT location, latitude, longitude, scores, updated_at, "
+                    "version FROM assessments WHERE version > ? ORDER BY version",
+                    (self._version,)).fetchall()
+            finally:
+                conn.close()
+            for location, latitude, longitude, scores, updated_at, version in rows:
+                super().upsert(location, latitude, longitude,
+                               json.loads(scores), updated_at)
+                self._version = version
+
+    def query(self, query: SpatialQuery) -> Dict[str, Any]:
+        """Sync with the database, then query as AssessmentStore.query."""
+        self.sync()
+        return super().query(query)
@@ -1,8 +1,10 @@
 """
 Test client for Location Risk Assessment API
 """
+import os
 import requests
 import json
+from dotenv import load_dotenv
 
 
 def test_api(base_url: str = "http://localhost:8000"):
@@ -12,9 +14,17 @@ def test_api(base_url: str = "http://localhost:8000"):
     print(f"Base URL: {base_url}")
     print("-" * 50)
 
+    # Reuse one connection for every call and send the auth headers
+    load_dotenv()
+    session = requests.Session()
+    session.headers.update({
+        "X-API-Key": os.getenv("API_KEY", "4590afd6-c4ed-43f1-8f8d"),
+        "X-Vendor-ID": os.getenv("VENDOR_ID", "c8w3e")
+    })
+
     # Test health endpoint
     try:
-        response = requests.get(f"{base_url}/health")
+        response = session.get(f"{base_url}/health")
         print(f"Health Check: {response.status_code}")
         print(f"Response: {response.json()}")
         print()
@@ -24,7 +34,7 @@ def test_api(base_url: str = "http://localhost:8000"):
 
     # Test root endpoint
     try:
-        response = requests.get(f"{base_url}/")
+        response = session.get(f"{base_url}/")
         print(f"Root Endpoint: {response.status_code}")
         print(f"Response: {json.dumps(response.json(), indent=2)}")
         print()
@@ -43,7 +53,7 @@ def test_api(base_url: str = "http://localhost:8000"):
     for location in test_locations:
         try:
             payload = {"location": location}
-            response = requests.post(f"{base_url}/analyze", json=payload)
+            response = session.post(f"{base_url}/analyze", json=payload)
 
             print(f"Analyzing: {location}")
             print(f"Status Code: {response.status_code}")
@@ -74,7 +84,7 @@ def test_api(base_url: str = "http://localhost:8000"):
     for location in sea_level_locations:
         try:
             payload = {"location": location}
-            response = requests.post(f"{base_url}/sea-level", json=payload)
+            response = session.post(f"{base_url}/sea-level", json=payload)
 
             print(f"Sea Level Analysis: {location}")
             print(f"Status Code: {response.status_code}")